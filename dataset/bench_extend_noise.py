@@ -0,0 +1,64 @@
+import argparse
+import timeit
+import numpy as np
+
+from create_librimix_from_metadata import extend_noise, RATE
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--noise_seconds', type=float, nargs='+',
+                    default=[0.75, 2, 5],
+                    help='Lengths of the noise clips to extend')
+parser.add_argument('--target_seconds', type=float, nargs='+',
+                    default=[15, 60, 300],
+                    help='Lengths to extend them to')
+parser.add_argument('--number', type=int, default=3,
+                    help='Timed runs per case, the best one is reported')
+
+
+def extend_noise_concat(noise, max_length):
+    """ Previous implementation, concatenates the whole signal again at
+    every repetition """
+    noise_ex = noise
+    window = np.hanning(RATE + 1)
+    # Increasing window
+    i_w = window[:len(window) // 2 + 1]
+    # Decreasing window
+    d_w = window[len(window) // 2::-1]
+    # Extend until max_length is reached
+    while len(noise_ex) < max_length:
+        noise_ex = np.concatenate((noise_ex[:len(noise_ex) - len(d_w)],
+                                   np.multiply(
+                                       noise_ex[len(noise_ex) - len(d_w):],
+                                       d_w) + np.multiply(
+                                       noise[:len(i_w)], i_w),
+                                   noise[len(i_w):]))
+    noise_ex = noise_ex[:max_length]
+    return noise_ex
+
+
+def main(args):
+    rng = np.random.RandomState(0)
+    print(f"{'noise (s)':>10} {'target (s)':>10} {'concat (ms)':>12} "
+          f"{'buffer (ms)':>12} {'speedup':>8} identical")
+    for noise_seconds in args.noise_seconds:
+        noise = rng.randn(int(noise_seconds * RATE)).astype(np.float32)
+        for target_seconds in args.target_seconds:
+            max_length = int(target_seconds * RATE)
+            if max_length <= len(noise):
+                continue
+            identical = np.array_equal(extend_noise_concat(noise, max_length),
+                                       extend_noise(noise, max_length))
+            t_old = min(timeit.repeat(
+                lambda: extend_noise_concat(noise, max_length),
+                number=1, repeat=args.number))
+            t_new = min(timeit.repeat(
+                lambda: extend_noise(noise, max_length),
+                number=1, repeat=args.number))
+            print(f"{noise_seconds:>10.2f} {target_seconds:>10.0f} "
+                  f"{t_old * 1000:>12.2f} {t_new * 1000:>12.2f} "
+                  f"{t_old / t_new:>7.1f}x {identical}")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    main(args)
@@ -1,11 +1,17 @@
 import os
+import io
+import csv
+import glob
+import json
+import tarfile
 import argparse
 import soundfile as sf
 import pandas as pd
 import numpy as np
 import functools
+from multiprocessing import Pool
 from scipy.signal import resample_poly
-import tqdm.contrib.concurrent
+import tqdm
 
 # eps secures log and division
 EPS = 1e-10
@@ -15,8 +21,9 @@ RATE = 16000
 parser = argparse.ArgumentParser()
 parser.add_argument('--librispeech_dir', type=str, required=True,
                     help='Path to librispeech root directory')
-parser.add_argument('--wham_dir', type=str, required=True,
-                    help='Path to wham_noise root directory')
+parser.add_argument('--wham_dir', type=str, default=None,
+                    help='Path to wham_noise root directory, only needed '
+                         'for the mix_both and mix_single types')
 parser.add_argument('--metadata_dir', type=str, required=True,
                     help='Path to the LibriMix metadata directory')
 parser.add_argument('--librimix_outdir', type=str, default=None,
@@ -32,6 +39,22 @@ parser.add_argument('--modes', nargs='+', default=['min', 'max'],
 parser.add_argument('--types', nargs='+', default=['mix_clean', 'mix_both',
                                                    'mix_single'],
                     help='--types mix_clean mix_both mix_single ')
+parser.add_argument('--shard_size', type=int, default=0,
+                    help='Write the wavs of every shard_size mixtures into '
+                         'one tar shard (<subset>/shards) instead of one '
+                         'file per signal, 0 keeps the files')
+parser.add_argument('--subset_size', nargs='+', default=None,
+                    help='--subset_size 250 generates 250 mixtures of every '
+                         'split, --subset_size test=250 train-100=1000 sets '
+                         'it per split (split names as the output '
+                         'directories)')
+parser.add_argument('--subset_fraction', nargs='+', default=None,
+                    help='Same as --subset_size with a fraction of the rows, '
+                         '--subset_fraction 0.1 or test=0.1')
+parser.add_argument('--subset_seed', type=int, default=0,
+                    help='Seed of the subset selection, the same seed gives '
+                         'the same rows and a larger subset contains the '
+                         'smaller ones')
 
 
 def main(args):
@@ -54,13 +77,59 @@ def main(args):
     modes = [mode.lower() for mode in modes]
     types = args.types
     types = [t.lower() for t in types]
+    if uses_noise(types) and wham_dir is None:
+        parser.error('--wham_dir is required for mix_both and mix_single')
     # Get the number of sources
+    subset = (parse_per_split(args.subset_size, int),
+              parse_per_split(args.subset_fraction, float), args.subset_seed)
     create_librimix(librispeech_dir, wham_dir, librimix_outdir, metadata_dir,
-                    freqs, n_src, modes, types)
+                    freqs, n_src, modes, types, args.shard_size, subset)
+
+
+def uses_noise(types):
+    """ Whether any of the requested mixture types contains noise """
+    return any(t != 'mix_clean' for t in types)
+
+
+def parse_per_split(values, cast):
+    """ Map split -> value, the None key holds the value of every split """
+    per_split = {}
+    for value in values or []:
+        split, _, value = value.rpartition('=')
+        per_split[split or None] = cast(value)
+    return per_split
+
+
+def select_rows(csv_path, split, subset):
+    """ Sorted indices of the rows of a metadata file to generate, None
+    for all of them. The selection only depends on the seed, the split and
+    the size, never on freqs, modes or workers """
+    sizes, fractions, seed = subset
+    size = sizes.get(split, sizes.get(None))
+    fraction = fractions.get(split, fractions.get(None))
+    if size is None and fraction is None:
+        return None
+    # Count the rows without parsing them
+    with open(csv_path, 'r') as f:
+        n_rows = sum(1 for _ in f) - 1
+    if size is None:
+        size = int(round(fraction * n_rows))
+    # Prefixes of one permutation, so that subsets are nested
+    order = np.random.RandomState(seed).permutation(n_rows)
+    return np.sort(order[:min(size, n_rows)])
+
+
+def read_metadata(csv_path, rows=None):
+    """ Read a metadata file, or only the given rows of it """
+    if rows is None:
+        return pd.read_csv(csv_path)
+    # Line 0 is the header, row i is line i + 1
+    keep = set((rows + 1).tolist()) | {0}
+    return pd.read_csv(csv_path, skiprows=lambda line: line not in keep)
 
 
 def create_librimix(librispeech_dir, wham_dir, out_dir, metadata_dir,
-                    freqs, n_src, modes, types):
+                    freqs, n_src, modes, types, shard_size=0, subset=None):
     """ Generate sources mixtures and saves them in out_dir"""
     # Get metadata files
     md_filename_list = [file for file in os.listdir(metadata_dir)
@@ -69,13 +138,33 @@ def create_librimix(librispeech_dir, wham_dir, out_dir, metadata_dir,
     for md_filename in md_filename_list:
         csv_path = os.path.join(metadata_dir, md_filename)
         process_metadata_file(csv_path, freqs, n_src, librispeech_dir,
-                              wham_dir, out_dir, modes, types)
+                              wham_dir, out_dir, modes, types, shard_size,
+                              subset)
 
 
 def process_metadata_file(csv_path, freqs, n_src, librispeech_dir, wham_dir,
-                          out_dir, modes, types):
+                          out_dir, modes, types, shard_size=0,
+                          subset=None):
     """ Process a metadata generation file to create sources and mixtures"""
-    md_file = pd.read_csv(csv_path, engine='python')
+    # Directory where the mixtures and sources will be stored
+    dir_name = os.path.basename(csv_path).replace(
+        f'libri{n_src}mix_', '').replace('-clean', '').replace(
+        '.csv', '')
+    rows = None
+    if subset is not None:
+        rows = select_rows(csv_path, dir_name, subset)
+    md_file = read_metadata(csv_path, rows)
+    if rows is not None:
+        print(f"Subset of {len(md_file)} mixtures from {csv_path}")
+    # Create subdir, the noise is only read and written if a type uses it
+    if not uses_noise(types):
+        subdirs = [f's{i + 1}' for i in range(n_src)] + types
+    else:
+        subdirs = [f's{i + 1}' for i in range(n_src)] + types + [
+            'noise']
+    # Every (freq, mode) output of this metadata file, all of them are
+    # generated in one pass over the rows
+    targets = []
     for freq in freqs:
         # Get the frequency directory path
         freq_path = os.path.join(out_dir, 'wav' + freq)
@@ -88,85 +177,264 @@ def process_metadata_file(csv_path, freqs, n_src, librispeech_dir, wham_dir,
             # Subset metadata path
             subset_metadata_path = os.path.join(mode_path, 'metadata')
             os.makedirs(subset_metadata_path, exist_ok=True)
-            # Directory where the mixtures and sources will be stored
-            dir_name = os.path.basename(csv_path).replace(
-                f'libri{n_src}mix_', '').replace('-clean', '').replace(
-                '.csv', '')
             dir_path = os.path.join(mode_path, dir_name)
-            # If the files already exist then continue the loop
-            if os.path.isdir(dir_path):
+            # A directory without journal was made before journaling
+            # existed, it is left untouched
+            journal_path = os.path.join(dir_path, 'journal.jsonl')
+            if os.path.isdir(dir_path) and not os.path.exists(journal_path):
                 print(f"Directory {dir_path} already exist. "
                       f"Files won't be overwritten")
                 continue
 
             print(f"Creating mixtures and sources from {csv_path} "
                   f"in {dir_path}")
-            # Create subdir
-            if types == ['mix_clean']:
-                subdirs = [f's{i + 1}' for i in range(n_src)] + ['mix_clean']
-            else:
-                subdirs = [f's{i + 1}' for i in range(n_src)] + types + [
-                    'noise']
             # Create directories accordingly
-            for subdir in subdirs:
-                os.makedirs(os.path.join(dir_path, subdir))
-            # Go through the metadata file
-            process_utterances(md_file, librispeech_dir, wham_dir, freq, mode,
-                               subdirs, dir_path, subset_metadata_path, n_src)
+            if shard_size:
+                os.makedirs(os.path.join(dir_path, 'shards'), exist_ok=True)
+            else:
+                for subdir in subdirs:
+                    os.makedirs(os.path.join(dir_path, subdir), exist_ok=True)
+            open(journal_path, 'a').close()
+            targets.append((freq, mode, dir_path, subset_metadata_path))
+    if not targets:
+        return
+    # Go through the metadata file
+    process_utterances(md_file, librispeech_dir, wham_dir, targets, subdirs,
+                       n_src, shard_size)
+
+
+def process_utterances(md_file, librispeech_dir, wham_dir, targets, subdirs,
+                       n_src, shard_size=0):
+    # Every finished mixture is one line of the journal of its target, a
+    # rerun only generates the mixtures that are not in it yet
+    journal_paths = [os.path.join(dir_path, 'journal.jsonl')
+                     for _, _, dir_path, _ in targets]
+    done = [read_journal_ids(journal_path) for journal_path in journal_paths]
+    # Rows are sent to the workers as plain tuples, with the indices of
+    # the targets they are missing from
+    columns = list(md_file.columns)
+    tasks = []
+    for row in md_file.itertuples(index=False, name=None):
+        mix_id = row[columns.index('mixture_ID')]
+        todo = [t for t in range(len(targets)) if mix_id not in done[t]]
+        if todo:
+            tasks.append((row, todo))
+    if any(done):
+        print(f"{len(md_file) - len(tasks)} mixtures already done, "
+              f"{len(tasks)} left")
+
+    # Go through the metadata file and generate mixtures, each result is
+    # journaled as it arrives, or once its shard is complete
+    journals = [open(journal_path, 'a') for journal_path in journal_paths]
+    shards = [ShardWriter(os.path.join(dir_path, 'shards'), journal, shard_size)
+              if shard_size else None
+              for (_, _, dir_path, _), journal in zip(targets, journals)]
+    with Pool() as pool:
+        for journal, journal_path in zip(journals, journal_paths):
+            # Terminate a line cut by an interrupted run, it is then skipped
+            if journal.tell() and not journal_ends_with_newline(journal_path):
+                journal.write('\n')
+        for target_results in tqdm.tqdm(pool.imap(
+                functools.partial(process_utterance, n_src, librispeech_dir,
+                                  wham_dir, targets, subdirs, columns,
+                                  bool(shard_size)),
+                tasks, chunksize=10), total=len(tasks)):
+            for t, results, members in target_results:
+                if shards[t] is not None:
+                    shards[t].add(results, members)
+                    continue
+                journals[t].write(json.dumps(results) + '\n')
+                journals[t].flush()
+        for shard in shards:
+            if shard is not None:
+                shard.close()
+    for journal in journals:
+        journal.close()
+
+    for journal_path, (_, _, dir_path, subset_metadata_path) in zip(
+            journal_paths, targets):
+        write_metadata(journal_path, subdirs, dir_path, subset_metadata_path,
+                       n_src)
+        if shard_size:
+            write_shard_index(journal_path, os.path.join(dir_path, 'shards'))
+
+
+class ShardWriter:
+    """ Append the wavs of the mixtures of one target to tar shards
+
+    Members are named <subdir>/<mixture_ID>.wav and the members of a mixture
+    are consecutive. A shard is written as .tar.tmp and renamed once it holds
+    shard_size mixtures, only then are its mixtures journaled, so a rerun
+    redoes the mixtures of an unfinished shard.
+    """
+
+    def __init__(self, shard_dir, journal, shard_size):
+        self.shard_dir = shard_dir
+        self.journal = journal
+        self.shard_size = shard_size
+        # Finished shards of a previous run are kept
+        self.index = len(glob.glob(os.path.join(shard_dir, 'shard-*.tar')))
+        self.tar = None
+        self.pending = []
+
+    def path(self):
+        return os.path.join(self.shard_dir, f'shard-{self.index:06d}.tar')
+
+    def add(self, results, members):
+        if self.tar is None:
+            self.tar = tarfile.open(self.path() + '.tmp', 'w')
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            self.tar.addfile(info, io.BytesIO(data))
+        self.pending.append(results)
+        if len(self.pending) == self.shard_size:
+            self.finalize()
+
+    def finalize(self):
+        self.tar.close()
+        path = os.path.abspath(self.path())
+        os.replace(path + '.tmp', path)
+        # Paths of the metadata point into the shard: <shard>/<member>
+        for results in self.pending:
+            results = [(mix_id, snr_list, f'{path}/{mix_member}',
+                        [f'{path}/{member}' for member in source_members],
+                        noise_member and f'{path}/{noise_member}',
+                        length, subdir)
+                       for mix_id, snr_list, mix_member, source_members,
+                       noise_member, length, subdir in results]
+            self.journal.write(json.dumps(results) + '\n')
+        self.journal.flush()
+        self.index += 1
+        self.tar = None
+        self.pending = []
+
+    def close(self):
+        if self.tar is not None:
+            self.finalize()
+
+
+def write_shard_index(journal_path, shard_dir):
+    """ Write shards/index.tsv: shard, mixture ID and length of every
+    mixture, in shard order, for the training readers """
+    index = []
+    for results in read_journal(journal_path):
+        mix_id, _, mix_path, _, _, length, _ = results[0]
+        shard = os.path.basename(mix_path.rsplit('.tar/', 1)[0] + '.tar')
+        index.append((shard, mix_id, length))
+    index.sort(key=lambda entry: entry[0])
+    path = os.path.join(shard_dir, 'index.tsv')
+    with open(path + '.tmp', 'w', newline='') as f:
+        writer = csv.writer(f, delimiter='\t', lineterminator='\n')
+        writer.writerow(['shard', 'mixture_ID', 'length'])
+        writer.writerows(index)
+    os.replace(path + '.tmp', path)
+
+
+def journal_ends_with_newline(journal_path):
+    with open(journal_path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
+
+
+def read_journal_ids(journal_path):
+    """ Mixture IDs of the journal, a truncated last line is ignored """
+    done = set()
+    for results in read_journal(journal_path):
+        done.add(results[0][0])
+    return done
+
+
+def read_journal(journal_path):
+    """ Results of every journaled mixture """
+    if not os.path.exists(journal_path):
+        return
+    with open(journal_path, 'r') as f:
+        for line in f:
+            try:
+                results = json.loads(line)
+            except ValueError:
+                # Line cut by an interrupted run, the mixture is redone
+                continue
+            if results:
+                yield results
 
 
-def process_utterances(md_file, librispeech_dir, wham_dir, freq, mode, subdirs,
-                       dir_path, subset_metadata_path, n_src):
-    # Dictionary that will contain all metadata
+def write_metadata(journal_path, subdirs, dir_path, subset_metadata_path,
+                   n_src):
+    """ Rebuild the metadata files of a subset from its journal """
+    # Dictionary that will contain the open metadata files and their writers
     md_dic = {}
     # Get dir name
     dir_name = os.path.basename(dir_path)
-    # Create Dataframes
+    # Create the metadata files in out_dir ./data/wavxk/mode/subset
     for subdir in subdirs:
         if subdir.startswith('mix'):
-            md_dic[f'metrics_{dir_name}_{subdir}'] = create_empty_metrics_md(
-                n_src, subdir)
-            md_dic[f'mixture_{dir_name}_{subdir}'] = create_empty_mixture_md(
-                n_src, subdir)
-
-    # Go through the metadata file and generate mixtures
-    for results in tqdm.contrib.concurrent.process_map(
-        functools.partial(
-            process_utterance,
-            n_src, librispeech_dir, wham_dir, freq, mode, subdirs, dir_path),
-        [row for _, row in md_file.iterrows()],
-        chunksize=10,
-    ):
+            for md_name, columns in [
+                    (f'metrics_{dir_name}_{subdir}',
+                     metrics_md_columns(n_src, subdir)),
+                    (f'mixture_{dir_name}_{subdir}',
+                     mixture_md_columns(n_src, subdir))]:
+                path = os.path.join(subset_metadata_path, md_name + '.csv')
+                f = open(path + '.tmp', 'w', newline='')
+                md_dic[md_name] = (f, csv.writer(f, lineterminator='\n'), path)
+                md_dic[md_name][1].writerow(columns)
+
+    for results in read_journal(journal_path):
         for mix_id, snr_list, abs_mix_path, abs_source_path_list, abs_noise_path, length, subdir in results:
-            # Add line to the dataframes
-            add_to_metrics_metadata(md_dic[f"metrics_{dir_name}_{subdir}"],
+            # Add line to the metadata files
+            add_to_metrics_metadata(md_dic[f"metrics_{dir_name}_{subdir}"][1],
                                     mix_id, snr_list)
-            add_to_mixture_metadata(md_dic[f'mixture_{dir_name}_{subdir}'],
+            add_to_mixture_metadata(md_dic[f'mixture_{dir_name}_{subdir}'][1],
                                     mix_id, abs_mix_path, abs_source_path_list,
                                     abs_noise_path, length, subdir)
 
-    # Save the metadata files
-    for md_df in md_dic:
-        # Save the metadata in out_dir ./data/wavxk/mode/subset
-        save_path_mixture = os.path.join(subset_metadata_path, md_df + '.csv')
-        md_dic[md_df].to_csv(save_path_mixture, index=False)
+    for f, _, path in md_dic.values():
+        f.close()
+        os.replace(path + '.tmp', path)
 
 
-def process_utterance(n_src, librispeech_dir, wham_dir, freq, mode, subdirs, dir_path, row):
-    res = []
-    # Get sources and mixture infos
+def process_utterance(n_src, librispeech_dir, wham_dir, targets, subdirs,
+                      columns, to_shard, task):
+    row, todo = task
+    # Row of the metadata file, as a column -> value dict
+    row = dict(zip(columns, row))
+    # Get sources and mixture infos, decoded once for all the targets
     mix_id, gain_list, sources = read_sources(row, n_src, librispeech_dir,
-                                              wham_dir)
-    # Transform sources
-    transformed_sources = transform_sources(sources, freq, mode, gain_list)
+                                              wham_dir, 'noise' in subdirs)
+    # Normalize sources
+    sources_list_norm = loudness_normalize(sources, gain_list)
+    # Resample once per frequency, min and max are cut from the same buffers
+    resampled = {}
+    target_results = []
+    for t in todo:
+        freq, mode, dir_path, _ = targets[t]
+        if freq not in resampled:
+            resampled[freq] = resample_list(sources_list_norm, freq)
+        # Reshape sources
+        transformed_sources = fit_lengths(resampled[freq], mode)
+        # In shard mode the wavs are encoded here and written by the parent
+        members = [] if to_shard else None
+        results = write_utterance(n_src, mix_id, transformed_sources, freq,
+                                  subdirs, dir_path, members)
+        target_results.append((t, results, members))
+    return target_results
+
+
+def write_utterance(n_src, mix_id, transformed_sources, freq, subdirs,
+                    dir_path, members=None):
+    """ Write the sources, noise and mixtures of one target """
+    res = []
     # Write the sources and get their paths
     abs_source_path_list = write_sources(mix_id,
                                          transformed_sources,
                                          subdirs, dir_path, freq,
-                                         n_src)
+                                         n_src, members)
     # Write the noise and get its path
-    abs_noise_path = write_noise(mix_id, transformed_sources, dir_path,
-                                 freq)
+    abs_noise_path = None
+    if 'noise' in subdirs:
+        abs_noise_path = write_noise(mix_id, transformed_sources, dir_path,
+                                     freq, members)
     # Mixtures are different depending on the subdir
     for subdir in subdirs:
         if subdir == 'mix_clean':
@@ -182,54 +450,53 @@ def process_utterance(n_src, librispeech_dir, wham_dir, freq, mode, subdirs, dir
         # Mix sources
         mixture = mix(sources_to_mix)
         # Write mixture and get its path
-        abs_mix_path = write_mix(mix_id, mixture, dir_path, subdir, freq)
+        abs_mix_path = write_mix(mix_id, mixture, dir_path, subdir, freq,
+                                 members)
         length = len(mixture)
-        # Compute SNR
-        snr_list = compute_snr_list(mixture, sources_to_mix)
+        # Compute SNR, as plain floats for the journal
+        snr_list = [float(snr) for snr in compute_snr_list(mixture, sources_to_mix)]
         res.append((mix_id, snr_list, abs_mix_path,
                    abs_source_path_list, abs_noise_path, length, subdir))
 
     return res
 
 
-def create_empty_metrics_md(n_src, subdir):
-    """ Create the metrics dataframe"""
-    metrics_dataframe = pd.DataFrame()
-    metrics_dataframe['mixture_ID'] = {}
+def metrics_md_columns(n_src, subdir):
+    """ Columns of the metrics metadata file"""
+    columns = ['mixture_ID']
     if subdir == 'mix_clean':
         for i in range(n_src):
-            metrics_dataframe[f"source_{i + 1}_SNR"] = {}
+            columns.append(f"source_{i + 1}_SNR")
     elif subdir == 'mix_both':
         for i in range(n_src):
-            metrics_dataframe[f"source_{i + 1}_SNR"] = {}
-        metrics_dataframe[f"noise_SNR"] = {}
+            columns.append(f"source_{i + 1}_SNR")
+        columns.append("noise_SNR")
     elif subdir == 'mix_single':
-        metrics_dataframe["source_1_SNR"] = {}
-        metrics_dataframe[f"noise_SNR"] = {}
-    return metrics_dataframe
+        columns.append("source_1_SNR")
+        columns.append("noise_SNR")
+    return columns
 
 
-def create_empty_mixture_md(n_src, subdir):
-    """ Create the mixture dataframe"""
-    mixture_dataframe = pd.DataFrame()
-    mixture_dataframe['mixture_ID'] = {}
-    mixture_dataframe['mixture_path'] = {}
+def mixture_md_columns(n_src, subdir):
+    """ Columns of the mixture metadata file"""
+    columns = ['mixture_ID', 'mixture_path']
     if subdir == 'mix_clean':
         for i in range(n_src):
-            mixture_dataframe[f"source_{i + 1}_path"] = {}
+            columns.append(f"source_{i + 1}_path")
     elif subdir == 'mix_both':
         for i in range(n_src):
-            mixture_dataframe[f"source_{i + 1}_path"] = {}
-        mixture_dataframe[f"noise_path"] = {}
+            columns.append(f"source_{i + 1}_path")
+        columns.append("noise_path")
     elif subdir == 'mix_single':
-        mixture_dataframe["source_1_path"] = {}
-        mixture_dataframe[f"noise_path"] = {}
-    mixture_dataframe['length'] = {}
-    return mixture_dataframe
+        columns.append("source_1_path")
+        columns.append("noise_path")
+    columns.append('length')
+    return columns
 
 
-def read_sources(row, n_src, librispeech_dir, wham_dir):
-    """ Get sources and info to mix the sources """
+def read_sources(row, n_src, librispeech_dir, wham_dir, use_noise=True):
+    """ Get sources and info to mix the sources, the noise is appended
+    last when use_noise """
     # Get info about the mixture
     mixture_id = row['mixture_ID']
     sources_path_list = get_list_from_csv(row, 'source_path', n_src)
@@ -245,6 +512,8 @@ def read_sources(row, n_src, librispeech_dir, wham_dir):
         if max_length < len(source):
             max_length = len(source)
         sources_list.append(source)
+    if not use_noise:
+        return mixture_id, gain_list, sources_list
     # Read the noise
     noise_path = os.path.join(wham_dir, row['noise_path'])
     noise, _ = sf.read(noise_path, dtype='float32', stop=max_length)
@@ -272,36 +541,48 @@ def get_list_from_csv(row, column, n_src):
 
 
 def extend_noise(noise, max_length):
-    """ Concatenate noise using hanning window"""
-    noise_ex = noise
+    """ Concatenate noise using hanning window
+
+    Every repetition of the noise starts with a crossfade of length W with
+    the end of the previous one and adds len(noise) - W samples. The result
+    is written into one preallocated buffer instead of concatenating the
+    whole signal again at every repetition.
+    """
     window = np.hanning(RATE + 1)
     # Increasing window
     i_w = window[:len(window) // 2 + 1]
     # Decreasing window
     d_w = window[len(window) // 2::-1]
-    # Extend until max_length is reached
-    while len(noise_ex) < max_length:
-        noise_ex = np.concatenate((noise_ex[:len(noise_ex) - len(d_w)],
-                                   np.multiply(
-                                       noise_ex[len(noise_ex) - len(d_w):],
-                                       d_w) + np.multiply(
-                                       noise[:len(i_w)], i_w),
-                                   noise[len(i_w):]))
+    n, w = len(noise), len(i_w)
+    if n <= w:
+        raise ValueError(f"Noise of {n} samples is too short to be "
+                         f"extended with a {w} samples crossfade")
+    period = n - w
+    repeats = -(-(max_length - n) // period)
+    noise_ex = np.empty(n + repeats * period)
+    if period >= w:
+        # The crossfades never overlap, so they are all the same and the
+        # signal is noise[:period] followed by a tiled
+        # [crossfade, noise[w:n - w]] unit, ending with noise[n - w:]
+        fade = noise[period:] * d_w + noise[:w] * i_w
+        unit = np.concatenate((fade, noise[w:period]))
+        noise_ex[:period] = noise[:period]
+        noise_ex[period:len(noise_ex) - w] = np.tile(unit, repeats)
+        noise_ex[len(noise_ex) - w:] = noise[period:]
+    else:
+        # Short noise: each crossfade overlaps the previous one, extend
+        # in place repetition by repetition
+        noise_ex[:n] = noise
+        length = n
+        for _ in range(repeats):
+            noise_ex[length - w:length] = (noise_ex[length - w:length] * d_w
+                                           + noise[:w] * i_w)
+            noise_ex[length:length + period] = noise[w:]
+            length += period
     noise_ex = noise_ex[:max_length]
     return noise_ex
 
 
-def transform_sources(sources_list, freq, mode, gain_list):
-    """ Transform libriSpeech sources to librimix """
-    # Normalize sources
-    sources_list_norm = loudness_normalize(sources_list, gain_list)
-    # Resample the sources
-    sources_list_resampled = resample_list(sources_list_norm, freq)
-    # Reshape sources
-    reshaped_sources = fit_lengths(sources_list_resampled, mode)
-    return reshaped_sources
-
-
 def loudness_normalize(sources_list, gain_list):
     """ Normalize sources loudness"""
     # Create the list of normalized sources
@@ -338,26 +619,26 @@ def fit_lengths(source_list, mode):
     return sources_list_reshaped
 
 
-def write_sources(mix_id, transformed_sources, subdirs, dir_path, freq, n_src):
+def write_sources(mix_id, transformed_sources, subdirs, dir_path, freq, n_src,
+                  members=None):
     # Write sources and mixtures and save their path
     abs_source_path_list = []
     ex_filename = mix_id + '.wav'
     for src, src_dir in zip(transformed_sources[:n_src], subdirs[:n_src]):
         save_path = os.path.join(dir_path, src_dir, ex_filename)
         abs_save_path = os.path.abspath(save_path)
-        sf.write(abs_save_path, src, freq)
+        abs_save_path = write_wav(abs_save_path, src, freq, members)
         abs_source_path_list.append(abs_save_path)
     return abs_source_path_list
 
 
-def write_noise(mix_id, transformed_sources, dir_path, freq):
+def write_noise(mix_id, transformed_sources, dir_path, freq, members=None):
     # Write noise save it's path
     noise = transformed_sources[-1]
     ex_filename = mix_id + '.wav'
     save_path = os.path.join(dir_path, 'noise', ex_filename)
     abs_save_path = os.path.abspath(save_path)
-    sf.write(abs_save_path, noise, freq)
-    return abs_save_path
+    return write_wav(abs_save_path, noise, freq, members)
 
 
 def mix(sources_list):
@@ -369,13 +650,28 @@ def mix(sources_list):
     return mixture
 
 
-def write_mix(mix_id, mixture, dir_path, subdir, freq):
+def write_mix(mix_id, mixture, dir_path, subdir, freq, members=None):
     # Write noise save it's path
     ex_filename = mix_id + '.wav'
     save_path = os.path.join(dir_path, subdir, ex_filename)
     abs_save_path = os.path.abspath(save_path)
-    sf.write(abs_save_path, mixture, freq)
-    return abs_save_path
+    return write_wav(abs_save_path, mixture, freq, members)
+
+
+def write_wav(path, data, freq, members=None):
+    """ Write under a temporary name and rename, a killed run never leaves
+    a truncated wav behind the final name. With members, the encoded wav is
+    appended to it as a <subdir>/<file> shard member instead, and the member
+    name is returned in place of the path """
+    if members is not None:
+        buffer = io.BytesIO()
+        sf.write(buffer, data, freq, format='WAV')
+        name = '/'.join(path.split(os.sep)[-2:])
+        members.append((name, buffer.getvalue()))
+        return name
+    sf.write(path + '.tmp', data, freq, format='WAV')
+    os.replace(path + '.tmp', path)
+    return path
 
 
 def compute_snr_list(mixture, sources_list):
@@ -392,15 +688,15 @@ def snr_xy(x, y):
     return 10 * np.log10(np.mean(x ** 2) / (np.mean(y ** 2) + EPS) + EPS)
 
 
-def add_to_metrics_metadata(metrics_df, mixture_id, snr_list):
-    """ Add a new line to metrics_df"""
+def add_to_metrics_metadata(metrics_writer, mixture_id, snr_list):
+    """ Write a new line to the metrics file"""
     row_metrics = [mixture_id] + snr_list
-    metrics_df.loc[len(metrics_df)] = row_metrics
+    metrics_writer.writerow(row_metrics)
 
 
-def add_to_mixture_metadata(mix_df, mix_id, abs_mix_path, abs_sources_path,
+def add_to_mixture_metadata(mix_writer, mix_id, abs_mix_path, abs_sources_path,
                             abs_noise_path, length, subdir):
-    """ Add a new line to mixture_df """
+    """ Write a new line to the mixture file """
     sources_path = abs_sources_path
     noise_path = [abs_noise_path]
     if subdir == 'mix_clean':
@@ -408,7 +704,7 @@ def add_to_mixture_metadata(mix_df, mix_id, abs_mix_path, abs_sources_path,
     elif subdir == 'mix_single':
         sources_path = [abs_sources_path[0]]
     row_mixture = [mix_id, abs_mix_path] + sources_path + noise_path + [length]
-    mix_df.loc[len(mix_df)] = row_mixture
+    mix_writer.writerow(row_mixture)
 
 
 if __name__ == "__main__":
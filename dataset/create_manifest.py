@@ -0,0 +1,111 @@
+import os
+import argparse
+import soundfile as sf
+from concurrent.futures import ThreadPoolExecutor
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--streams', nargs='+', required=True,
+                    help='--streams mix=train/mix_clean s1=train/s1 s2=train/s2 '
+                         'one column per stream, the first one is the '
+                         'reference for sample rate and length')
+parser.add_argument('--out', type=str, required=True,
+                    help='Path of the manifest (.tsv) to write')
+parser.add_argument('--scp_prefix', type=str, default=None,
+                    help='Also write the legacy <prefix>_<stream>.scp files')
+parser.add_argument('--ext', type=str, default='.wav',
+                    help='Extension of the audio files')
+parser.add_argument('--n_jobs', type=int, default=32,
+                    help='Number of threads reading the headers')
+
+# Columns that follow the stream paths
+INFO_COLUMNS = ['sample_rate', 'channels', 'length']
+
+
+def main(args):
+    streams = [stream.split('=', 1) for stream in args.streams]
+    rows = build_manifest(streams, args.n_jobs, args.ext)
+    names = [name for name, _ in streams]
+    write_manifest(rows, names, args.out)
+    if args.scp_prefix is not None:
+        write_scps(rows, names, args.scp_prefix)
+    print(f"Wrote {len(rows)} entries to {args.out}")
+
+
+def scan_tree(root, ext='.wav'):
+    """ Map file name -> path of every audio file under root """
+    files = {}
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir():
+                    stack.append(entry.path)
+                elif entry.name.endswith(ext):
+                    if entry.name in files:
+                        raise ValueError(f"Duplicated key {entry.name} in "
+                                         f"{files[entry.name]} and {entry.path}")
+                    files[entry.name] = entry.path
+    return files
+
+
+def read_header(path):
+    """ (sample rate, channels, length) of an audio file, header only """
+    info = sf.info(path)
+    return info.samplerate, info.channels, info.frames
+
+
+def build_manifest(streams, n_jobs=32, ext='.wav'):
+    """ Scan the stream directories and read every header concurrently
+
+    streams is a list of (name, directory). Returns one dict per key, sorted
+    by key, with the path of every stream and the header info of the first
+    stream. Keys missing from a stream or with a different sample rate or
+    length across streams raise a ValueError.
+    """
+    with ThreadPoolExecutor(n_jobs) as pool:
+        trees = list(pool.map(lambda s: scan_tree(s[1], ext), streams))
+        keys = sorted(set().union(*trees))
+        for (name, directory), tree in zip(streams, trees):
+            missing = [key for key in keys if key not in tree]
+            if missing:
+                raise ValueError(f"{len(missing)} keys missing in {name} "
+                                 f"({directory}), e.g. {missing[:5]}")
+        paths = [tree[key] for key in keys for tree in trees]
+        headers = list(pool.map(read_header, paths))
+    rows = []
+    n = len(streams)
+    for i, key in enumerate(keys):
+        key_headers = headers[i * n:(i + 1) * n]
+        for (name, _), header in zip(streams[1:], key_headers[1:]):
+            if (header[0], header[2]) != (key_headers[0][0], key_headers[0][2]):
+                raise ValueError(f"{key}: {name} has sample rate/length "
+                                 f"{header[0]}/{header[2]}, {streams[0][0]} "
+                                 f"has {key_headers[0][0]}/{key_headers[0][2]}")
+        row = {'key': key}
+        for (name, _), path in zip(streams, paths[i * n:(i + 1) * n]):
+            row[name] = path
+        row.update(zip(INFO_COLUMNS, key_headers[0]))
+        rows.append(row)
+    return rows
+
+
+def write_manifest(rows, names, path):
+    """ Write the manifest as a tab separated file with a header line """
+    columns = ['key'] + names + INFO_COLUMNS
+    with open(path, 'w') as f:
+        f.write('\t'.join(columns) + '\n')
+        for row in rows:
+            f.write('\t'.join(str(row[c]) for c in columns) + '\n')
+
+
+def write_scps(rows, names, prefix):
+    """ Write one 'key path' scp per stream, as create_scp.py used to """
+    for name in names:
+        with open(f'{prefix}_{name}.scp', 'w') as f:
+            for row in rows:
+                f.write(row['key'] + ' ' + row[name] + '\n')
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    main(args)
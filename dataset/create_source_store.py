@@ -0,0 +1,89 @@
+import os
+import argparse
+import soundfile as sf
+import numpy as np
+import tqdm
+from multiprocessing import Pool
+
+from create_librimix_from_metadata import resample_list
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--librispeech_dir', type=str, required=True,
+                    help='Path to librispeech root directory')
+parser.add_argument('--subsets', nargs='+', default=['train-clean-100'],
+                    help='--subsets train-clean-100 train-clean-360 will '
+                         'put the utterances of both subsets in the store')
+parser.add_argument('--out_dir', type=str, required=True,
+                    help='Path to the desired source store directory')
+parser.add_argument('--freq', type=str, default='8k',
+                    help='Sample rate of the store, --freq 8k')
+parser.add_argument('--n_jobs', type=int, default=os.cpu_count(),
+                    help='Number of decoding processes')
+
+
+def main(args):
+    freq = int(args.freq.lower().strip('k')) * 1000
+    create_source_store(args.librispeech_dir, args.subsets, args.out_dir,
+                        freq, args.n_jobs)
+
+
+def list_utterances(librispeech_dir, subsets):
+    """ List the flac files of the subsets as (path, speaker) pairs """
+    utterances = []
+    for subset in subsets:
+        subset_dir = os.path.join(librispeech_dir, subset)
+        # LibriSpeech layout: subset/speaker/chapter/utterance.flac
+        for root, _, files in os.walk(subset_dir):
+            for file in files:
+                if file.endswith('.flac'):
+                    path = os.path.relpath(os.path.join(root, file),
+                                           librispeech_dir)
+                    speaker = os.path.relpath(root, subset_dir).split(os.sep)[0]
+                    utterances.append((path, speaker))
+    return sorted(utterances)
+
+
+def read_resampled(librispeech_dir, freq, path):
+    """ Decode one utterance and resample it to freq """
+    source, _ = sf.read(os.path.join(librispeech_dir, path), dtype='float32')
+    return resample_list([source], freq)[0].astype(np.float32)
+
+
+def create_source_store(librispeech_dir, subsets, out_dir, freq, n_jobs):
+    """ Decode and resample every utterance once into one flat float32 file
+
+    out_dir/sources.bin holds the samples of all utterances back to back,
+    out_dir/sources.idx.npz their offsets, speakers and relative paths, so
+    that utterance i is bin[offsets[i]:offsets[i + 1]].
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    utterances = list_utterances(librispeech_dir, subsets)
+    paths = [path for path, _ in utterances]
+    offsets = [0]
+    bin_path = os.path.join(out_dir, 'sources.bin')
+    # Decode in parallel, write in order from this process only
+    with Pool(n_jobs) as pool, open(bin_path + '.tmp', 'wb') as f:
+        for source in tqdm.tqdm(pool.imap(
+                _read_resampled, [(librispeech_dir, freq, p) for p in paths],
+                chunksize=16), total=len(paths)):
+            f.write(source.tobytes())
+            offsets.append(offsets[-1] + len(source))
+    os.replace(bin_path + '.tmp', bin_path)
+    # The index is written last: an interrupted run leaves no usable store
+    idx_path = os.path.join(out_dir, 'sources.idx.npz')
+    with open(idx_path + '.tmp', 'wb') as f:
+        np.savez(f, offsets=np.array(offsets, dtype=np.int64),
+                 speakers=np.array([spk for _, spk in utterances]),
+                 paths=np.array(paths), sample_rate=freq)
+    os.replace(idx_path + '.tmp', idx_path)
+    print(f"Wrote {len(paths)} utterances ({offsets[-1] / freq / 3600:.1f} h) "
+          f"to {out_dir}")
+
+
+def _read_resampled(args):
+    return read_resampled(*args)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    main(args)
@@ -1,22 +1,12 @@
-import os
-
-result_s1_scp = 'result_rnn_jusper_speaker1.scp'
-result_s2_scp = 'result_rnn_jusper_speaker2.scp'
-
-result_s1 = './result/DPCL_optim_jusper/spk1'
-result_s2 = './result/DPCL_optim_jusper/spk2'
-
-result_s1_file = open(result_s1_scp, 'w')
-for root, dirs, files in os.walk(result_s1):
-    files.sort()
-    for file in files:
-        result_s1_file.write(file+" "+root+'/'+file)
-        result_s1_file.write('\n')
-
-
-result_s2_file = open(result_s2_scp, 'w')
-for root, dirs, files in os.walk(result_s2):
-    files.sort()
-    for file in files:
-        result_s2_file.write(file+" "+root+'/'+file)
-        result_s2_file.write('\n')
\ No newline at end of file
+import sys
+sys.path.append('../dataset')
+
+from create_manifest import build_manifest, write_scps
+
+result = './result/DPCL_optim_jusper'
+
+# writes result_rnn_jusper_speaker1.scp and result_rnn_jusper_speaker2.scp
+streams = [('speaker1', result + '/spk1'),
+           ('speaker2', result + '/spk2')]
+rows = build_manifest(streams)
+write_scps(rows, [name for name, _ in streams], 'result_rnn_jusper')
@@ -1,3 +1,8 @@
+import hashlib
+import math
+import os
+import numpy as np
+import soundfile as sf
 import torch
 from utils.stft_istft import STFT
 import utils.util as ut
@@ -11,31 +16,89 @@ class AudioData(object):
         scp_file: the scp file path
         other kwargs is stft's kwargs
         is_mag: if True, abs(stft)
+        cache_dir: if set, every spectrogram is computed once and stored as
+                   .npy under this directory, later reads are memory-mapped.
+                   Entries are keyed by the scp entry and the stft settings,
+                   so changing nfft/hop_length/... uses new entries
+        cache_dtype: storage type of cached magnitudes, float32 or float16.
+                     complex spectrograms (is_mag=False) are kept as complex64
+        backend: stft backend, 'librosa' or 'torch' (see utils.stft_istft.STFT)
+        manifest: manifest written by create_scp.py, num_frames then takes
+                  the sample rate and length from it instead of the wav header
     '''
 
-    def __init__(self, scp_file, window='hann', nfft=256, window_length=256, hop_length=64, center=False, is_mag=True, is_log=True):
+    def __init__(self, scp_file, window='hann', nfft=256, window_length=256, hop_length=64, center=False, is_mag=True, is_log=True,
+                 cache_dir=None, cache_dtype='float32', backend='librosa', manifest=None):
         self.wave = ut.read_scp(scp_file)
         self.wave_keys = [key for key in self.wave.keys()]
+        self.manifest = ut.read_manifest(manifest) if manifest else {}
         self.STFT = STFT(window=window, nfft=nfft,
-                         window_length=window_length, hop_length=hop_length, center=center)
+                         window_length=window_length, hop_length=hop_length, center=center, backend=backend)
         self.is_mag = is_mag
         self.is_log = is_log
+        self.cache_dir = cache_dir
+        self.cache_dtype = np.dtype(cache_dtype)
+        if self.cache_dtype not in (np.float32, np.float16):
+            raise ValueError(
+                "Unsupported cache_dtype {}".format(cache_dtype))
+        self.setting = '{}_{}_{}_{}_{}_{}_{}_{}_{}'.format(
+            window, nfft, window_length, hop_length, center, is_mag, is_log, self.cache_dtype.name, backend)
 
     def __len__(self):
         return len(self.wave_keys)
 
+    def num_frames(self, key, sr=8000):
+        '''
+            stft frames of one key, computed from the wav header only
+            (sample count after resampling to sr, like ut.read_wav)
+        '''
+        if key in self.manifest:
+            rate, frames = self.manifest[key]['sample_rate'], self.manifest[key]['length']
+        else:
+            info = sf.info(self.wave[key])
+            rate, frames = info.samplerate, info.frames
+        samples = int(math.ceil(frames * sr / rate))
+        if self.STFT.center:
+            return 1 + samples // self.STFT.hop_length
+        return max(0, 1 + (samples - self.STFT.nfft) // self.STFT.hop_length)
+
     def stft(self, wave_path):
         samp = ut.read_wav(wave_path)
         return self.STFT.stft(samp, self.is_mag, self.is_log)
 
+    def cache_path(self, key):
+        entry = '{} {} {}'.format(key, self.wave[key], self.setting)
+        name = hashlib.sha1(entry.encode()).hexdigest()
+        return os.path.join(self.cache_dir, name[:2], name + '.npy')
+
+    def load(self, key):
+        '''
+            spectrogram of one key, from the feature cache if enabled
+        '''
+        if not self.cache_dir:
+            return self.stft(self.wave[key])
+        path = self.cache_path(key)
+        if not os.path.exists(path):
+            feat = self.stft(self.wave[key])
+            feat = feat.astype(np.complex64 if np.iscomplexobj(feat) else self.cache_dtype)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # unique temporary name + rename, concurrent workers never see a partial file
+            tmp_path = '{}.{}.tmp.npy'.format(path[:-4], os.getpid())
+            np.save(tmp_path, feat)
+            os.replace(tmp_path, path)
+        feat = np.load(path, mmap_mode='r')
+        if feat.dtype == np.float16:
+            feat = feat.astype(np.float32)
+        return feat
+
     def __iter__(self):
         for key in self.wave_keys:
-            yield self.stft(self.wave[key])
+            yield self.load(key)
 
     def __getitem__(self, key):
         if key not in self.wave_keys:
             raise ValueError
-        return self.stft(self.wave[key])
+        return self.load(key)
 
 
 if __name__ == "__main__":
@@ -4,7 +4,7 @@ sys.path.append('../deep_clustering_rnn/')
 from torch.nn.utils.rnn import pack_sequence, pad_sequence
 from data_loader import AudioData
 import torch
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import Dataset, DataLoader, Sampler
 from utils import util
 import pickle
 import numpy as np
@@ -27,12 +27,62 @@ class dataset(Dataset):
             raise ValueError
         return (self.mix_reader[key], [target[key] for target in self.target_readers])
 
+    def lengths(self):
+        '''
+           frames of every utterance, from the wav headers of the mixtures
+        '''
+        return [self.mix_reader.num_frames(key) for key in self.keys]
+
+
+class BucketBatchSampler(Sampler):
+    '''
+       Batch sampler that groups utterances of similar frame count
+       lengths: frames of every utterance of the dataset
+       batch_size: utterances per batch
+       num_buckets: utterances are sorted by length and split into
+                    num_buckets buckets of (nearly) equal size,
+                    every batch is drawn from a single bucket
+       shuffle: shuffle inside every bucket and the order of all batches
+    '''
+
+    def __init__(self, lengths, batch_size, num_buckets=10, shuffle=True):
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        order = np.argsort(np.array(lengths), kind='stable')
+        self.buckets = [b for b in np.array_split(order, num_buckets) if len(b) > 0]
+
+    def __len__(self):
+        return sum((len(b) + self.batch_size - 1) // self.batch_size for b in self.buckets)
+
+    def __iter__(self):
+        batches = []
+        for bucket in self.buckets:
+            if self.shuffle:
+                bucket = bucket[torch.randperm(len(bucket)).numpy()]
+            batches.extend(bucket[i:i+self.batch_size].tolist()
+                           for i in range(0, len(bucket), self.batch_size))
+        if self.shuffle:
+            batches = [batches[i] for i in torch.randperm(len(batches)).tolist()]
+        for batch in batches:
+            yield batch
+
 
 class dataloader(object):
-    def __init__(self, dataset, batch_size=40, shuffle=True, num_workers=16, cmvn_file='../cmvn.ark'):
+    '''
+       num_buckets: if > 0, batches are drawn by a BucketBatchSampler with
+                    that many length buckets instead of plain shuffling
+    '''
+
+    def __init__(self, dataset, batch_size=40, shuffle=True, num_workers=16, cmvn_file='../cmvn.ark', num_buckets=0):
         super(dataloader).__init__()
-        self.dataload = DataLoader(
-            dataset, batch_size=batch_size, num_workers=num_workers, shuffle=shuffle, collate_fn=self.collate)
+        if num_buckets > 0:
+            batch_sampler = BucketBatchSampler(
+                dataset.lengths(), batch_size, num_buckets=num_buckets, shuffle=shuffle)
+            self.dataload = DataLoader(
+                dataset, batch_sampler=batch_sampler, num_workers=num_workers, collate_fn=self.collate)
+        else:
+            self.dataload = DataLoader(
+                dataset, batch_size=batch_size, num_workers=num_workers, shuffle=shuffle, collate_fn=self.collate)
         self.cmvn = pickle.load(open(cmvn_file, 'rb'))
 
     def __len__(self):
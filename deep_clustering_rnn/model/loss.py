@@ -7,7 +7,8 @@ sys.path.append('../')
 class Loss(object):
     def __init__(self, mix_wave, target_waves, non_slient, num_spks):
         super(Loss).__init__()
-        self.mix_wave = mix_wave
+        # fp32 even for bf16 autocast embeddings
+        self.mix_wave = mix_wave.float()
         self.target_waves = target_waves
         self.non_slient = non_slient
         self.num_spks = num_spks
@@ -8,6 +8,8 @@ from config import option
 import argparse
 from model import model
 from utils.stft_istft import STFT
+from utils.pipeline import Prefetcher, AsyncWriter, queue_report
+from utils.util import autocast
 import os
 import librosa
 import pickle
@@ -26,8 +28,12 @@ class Separation(object):
         num_spks: speaker number
     '''
 
-    def __init__(self, dpcl, scp_file, opt, save_file):
+    def __init__(self, dpcl, scp_file, opt, save_file, num_io_workers=0, precision='fp32'):
         super(Separation, self).__init__()
+        # wavs are read and written in background threads when num_io_workers > 0
+        self.num_io_workers = num_io_workers
+        # fp32, or bf16 autocast of the embeddings
+        self.precision = precision
         if opt['train']['is_gpu']:
             self.dpcl = dpcl.cuda()
             self.device = torch.device(
@@ -53,10 +59,11 @@ class Separation(object):
         '''
         # TF x D
         print("hi i got pass through")
-        mix_emb = self.dpcl(torch.tensor(
-            wave, dtype=torch.float32), is_train=False)
+        with autocast(self.device, self.precision):
+            mix_emb = self.dpcl(torch.tensor(
+                wave, dtype=torch.float32), is_train=False)
         
-        mix_emb = mix_emb.detach().numpy()
+        mix_emb = mix_emb.detach().float().numpy()
         # N x D
         mix_emb = mix_emb[non_silent.reshape(-1)]
         # N
@@ -74,17 +81,25 @@ class Separation(object):
                          'nfft': self.opt['audio_setting']['nfft'],
                          'window_length': self.opt['audio_setting']['window_length'],
                          'hop_length': self.opt['audio_setting']['hop_length'],
-                         'center': self.opt['audio_setting']['center']}
+                         'center': self.opt['audio_setting']['center'],
+                         'backend': self.opt['audio_setting'].get('backend', 'librosa')}
 
         stft_istft = STFT(**stft_settings)
+        cmvn = pickle.load(open(self.opt['cmvn_file'], 'rb'))
+        if self.num_io_workers:
+            waves = Prefetcher(self.keys, self.waves.load, self.num_io_workers,
+                               depth=4*self.num_io_workers)
+            writer = AsyncWriter(self.num_io_workers, depth=8*self.num_io_workers)
+        else:
+            waves = ((key, self.waves.load(key)) for key in self.keys)
+            writer = None
         index = 0
-        for wave in tqdm(self.waves):
+        for name, wave in tqdm(waves, total=len(self.keys)):
             # log spk_spectrogram
             EPSILON = np.finfo(np.float32).eps
             log_wave = np.log(np.maximum(np.abs(wave), EPSILON))
 
             # apply cmvn
-            cmvn = pickle.load(open(self.opt['cmvn_file'], 'rb'))
             cmvn_wave = util.apply_cmvn(log_wave, cmvn)
 
             # calculate non silent
@@ -92,16 +107,21 @@ class Separation(object):
 
             target_mask = self._cluster(cmvn_wave, non_silent)
             for i in range(len(target_mask)):
-                name = self.keys[index]
                 spk_spectrogram = target_mask[i] * wave
                 i_stft = stft_istft.istft(spk_spectrogram)
                 output_file = os.path.join(
                     self.save_file, self.opt['name'], 'spk'+str(i+1))
                 os.makedirs(output_file, exist_ok=True)
 
-                librosa.output.write_wav(output_file+'/'+name, i_stft, 8000)
+                if writer is not None:
+                    writer.submit(librosa.output.write_wav, output_file+'/'+name, i_stft, 8000)
+                else:
+                    librosa.output.write_wav(output_file+'/'+name, i_stft, 8000)
                 #sf.write(output_file+'/'+name, i_stft, 8000)
             index += 1
+        if writer is not None:
+            writer.close()
+            print(queue_report(waves, writer))
         print('Processing {} utterances'.format(index))
 
 
@@ -113,9 +133,13 @@ if __name__ == "__main__":
                         help='Path to option YAML file.')
     parser.add_argument('-save_file', type=str,
                         help='Path to save file.')
+    parser.add_argument('-num_io_workers', type=int, default=0,
+                        help='Threads prefetching the inputs and writing the outputs')
+    parser.add_argument('-precision', type=str, default='fp32', choices=['fp32', 'bf16'],
+                        help='bf16 runs the model under bfloat16 autocast')
     args = parser.parse_args()
     opt = option.parse(args.opt)
     dpcl = model.DPCL(**opt['DPCL'])
 
-    separation = Separation(dpcl, args.scp, opt, args.save_file)
+    separation = Separation(dpcl, args.scp, opt, args.save_file, args.num_io_workers, args.precision)
     separation.run()
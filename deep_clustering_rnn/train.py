@@ -16,7 +16,8 @@ from data_loader.dataloader import dataset, dataloader
 def make_dataloader(opt):
     # make train's dataloader
     train_mix_reader = AudioData(
-        opt['datasets']['train']['dataroot_mix'], **opt['datasets']['audio_setting'])
+        opt['datasets']['train']['dataroot_mix'], manifest=opt['datasets']['train'].get('manifest'),
+        **opt['datasets']['audio_setting'])
     train_target_readers = [AudioData(opt['datasets']['train']['dataroot_targets'][0], **opt['datasets']['audio_setting']),
                             AudioData(opt['datasets']['train']['dataroot_targets'][1], **opt['datasets']['audio_setting'])]
     train_dataset = dataset(train_mix_reader, train_target_readers)
@@ -25,7 +26,8 @@ def make_dataloader(opt):
 
     # make validation dataloader
     val_mix_reader = AudioData(
-        opt['datasets']['val']['dataroot_mix'], **opt['datasets']['audio_setting'])
+        opt['datasets']['val']['dataroot_mix'], manifest=opt['datasets']['val'].get('manifest'),
+        **opt['datasets']['audio_setting'])
     val_target_readers = [AudioData(opt['datasets']['val']['dataroot_targets'][0], **opt['datasets']['audio_setting']),
                           AudioData(opt['datasets']['val']['dataroot_targets'][1], **opt['datasets']['audio_setting'])]
     val_dataset = dataset(val_mix_reader, val_target_readers)
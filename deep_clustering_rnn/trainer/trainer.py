@@ -2,6 +2,7 @@ import matplotlib.pyplot as plt
 import os
 import torch
 from model.loss import Loss
+from utils.util import autocast
 from logger.set_logger import setup_logger
 import logging
 import time
@@ -25,6 +26,9 @@ class Trainer(object):
         self.logger = logging.getLogger(opt['logger']['name'])
         self.checkpoint = opt['train']['path']
         self.name = opt['name']
+        # fp32, or bf16 autocast of the forward pass (the Loss stays in fp32)
+        self.precision = opt['train'].get('precision', 'fp32')
+        self.logger.info('Precision: {}'.format(self.precision))
 
         if opt['train']['is_gpu']:
             self.logger.info('Load Nvida GPU .....')
@@ -61,12 +65,18 @@ class Trainer(object):
         num_batchs = len(self.train_dataloader)
         total_loss = 0.0
         num_index = 1
+        num_frames = 0
+        num_padded = 0
         start_time = time.time()
         for mix_wave, target_waves, non_slient in self.train_dataloader:
+            # frames in the batch vs frames of the padded B x T x F loss input
+            num_frames += mix_wave.batch_sizes.sum().item()
+            num_padded += mix_wave.batch_sizes[0].item() * len(mix_wave.batch_sizes)
             mix_wave = mix_wave.to(self.device)
             target_waves = target_waves.to(self.device)
             non_slient = non_slient.to(self.device)
-            mix_embs = self.dpcl(mix_wave)
+            with autocast(self.device, self.precision):
+                mix_embs = self.dpcl(mix_wave)
             l = Loss(mix_embs, target_waves, non_slient, self.num_spks)
             epoch_loss = l.loss()
             total_loss += epoch_loss.item()
@@ -88,6 +98,8 @@ class Trainer(object):
         message = '<epoch:{:d}, iter:{:d}, lr:{:.3e}, loss:{:.3f}, Total time:{:.3f} min> '.format(
             epoch, num_batchs, self.optimizer.param_groups[0]['lr'], total_loss, (end_time-start_time)/60)
         self.logger.info(message)
+        self.logger.info('<epoch:{:d}, padding ratio:{:.3f}, frames/sec:{:.1f}>'.format(
+            epoch, 1 - num_frames/max(num_padded, 1), num_frames/(end_time-start_time)))
         return total_loss
 
     def validation(self, epoch):
@@ -103,7 +115,8 @@ class Trainer(object):
                 mix_wave = mix_wave.to(self.device)
                 target_waves = target_waves.to(self.device)
                 non_slient = non_slient.to(self.device)
-                mix_embs = self.dpcl(mix_wave)
+                with autocast(self.device, self.precision):
+                    mix_embs = self.dpcl(mix_wave)
                 l = Loss(mix_embs, target_waves, non_slient, self.num_spks)
                 epoch_loss = l.loss()
                 total_loss += epoch_loss.item()
@@ -0,0 +1,95 @@
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Prefetcher(object):
+    '''
+       Load items in a thread pool ahead of the consumer, in order
+       input:
+             items: list of items to load (keys, batches, ...)
+             load: function(item) -> data, run in the reader threads
+             num_workers: number of reader threads
+             depth: at most depth items are loaded or loading ahead
+       output:
+             iterating yields (item, data)
+       The number of loaded items waiting when the consumer asks for the
+       next one is recorded: near 0 means the readers are the bottleneck,
+       near depth means the consumer is.
+    '''
+
+    def __init__(self, items, load, num_workers=4, depth=16):
+        super(Prefetcher, self).__init__()
+        self.items = list(items)
+        self.load = load
+        self.num_workers = num_workers
+        self.depth = depth
+        self.ready = []
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        pending = collections.deque()
+        items = iter(self.items)
+        with ThreadPoolExecutor(self.num_workers) as pool:
+            for item in items:
+                pending.append((item, pool.submit(self.load, item)))
+                if len(pending) >= self.depth:
+                    break
+            while pending:
+                self.ready.append(sum(future.done() for _, future in pending))
+                item, future = pending.popleft()
+                data = future.result()
+                for next_item in items:
+                    pending.append((next_item, pool.submit(self.load, next_item)))
+                    break
+                yield item, data
+
+    def mean_depth(self):
+        return sum(self.ready) / max(len(self.ready), 1)
+
+
+class AsyncWriter(object):
+    '''
+       Run write calls in a thread pool, at most depth of them are pending
+       and submit blocks until the oldest one is done beyond that
+       input:
+             num_workers: number of writer threads
+             depth: maximum number of pending writes
+       The number of pending writes at every submit is recorded: near depth
+       means the writers are the bottleneck.
+    '''
+
+    def __init__(self, num_workers=4, depth=32):
+        super(AsyncWriter, self).__init__()
+        self.pool = ThreadPoolExecutor(num_workers)
+        self.depth = depth
+        self.pending = collections.deque()
+        self.queued = []
+
+    def submit(self, fn, *args, **kwargs):
+        while self.pending and self.pending[0].done():
+            self.pending.popleft().result()
+        self.queued.append(len(self.pending))
+        if len(self.pending) >= self.depth:
+            self.pending.popleft().result()
+        self.pending.append(self.pool.submit(fn, *args, **kwargs))
+
+    def close(self):
+        '''
+           wait for the pending writes, errors of the writes are raised here
+        '''
+        while self.pending:
+            self.pending.popleft().result()
+        self.pool.shutdown()
+
+    def mean_depth(self):
+        return sum(self.queued) / max(len(self.queued), 1)
+
+
+def queue_report(prefetcher, writer):
+    '''
+       One line summary of the queue depths of a pipelined run
+    '''
+    return 'reader queue {:.1f}/{:d} ready, writer queue {:.1f}/{:d} pending'.format(
+        prefetcher.mean_depth(), prefetcher.depth, writer.mean_depth(), writer.depth)
@@ -2,8 +2,10 @@ import sys
 sys.path.append('../')
 
 import torch
+import torch.nn.functional as F
 import librosa
 import numpy as np
+from scipy.signal import get_window
 from utils import util
 
 class STFT(object):
@@ -13,18 +15,35 @@ class STFT(object):
        nfft: length of the windowed signal after padding with zeros.
        window_length: window() of length win_length 
        hop_length: number of audio samples between adjacent STFT columns.
+       backend: 'librosa' (one utterance, numpy) or 'torch' (torch.stft,
+                float32, accepts padded batches B x T, needs torch>=1.8).
+                The torch backend returns tensors for tensor input and numpy
+                arrays for numpy input, with the same T x F (B x T x F) layout.
+                Centered frames are reflect padded like librosa 0.7.
     '''
 
-    def __init__(self, window='hann', nfft=256, window_length=256, hop_length=64,center=False):
+    def __init__(self, window='hann', nfft=256, window_length=256, hop_length=64,center=False, backend='librosa'):
         self.window = window
         self.nfft = nfft
         self.window_length = window_length
         self.hop_length = hop_length
         self.center =center
+        if backend not in ['librosa', 'torch']:
+            raise ValueError("Unknown stft backend {}".format(backend))
+        if backend == 'torch' and not hasattr(getattr(torch, 'fft', None), 'irfft'):
+            # torch < 1.8 has neither torch.fft.irfft nor complex torch.stft
+            raise RuntimeError("stft backend torch needs torch>=1.8, found {}".format(
+                torch.__version__))
+        self.backend = backend
+        self._window = None
+
     def stft(self, samp, is_mag=False,is_log=False):
         # is_mag: Whether the output is an amplitude value
+        if self.backend == 'torch':
+            return self._torch_io(self._torch_stft, samp, is_mag, is_log)
         stft_r = librosa.stft(samp, n_fft=self.nfft, hop_length=self.hop_length,
-                              win_length=self.window_length, window=self.window,center=self.center)
+                              win_length=self.window_length, window=self.window,center=self.center,
+                              pad_mode='reflect')
         stft_r = np.transpose(stft_r)
         if is_mag:
             stft_r = np.abs(stft_r)
@@ -33,16 +52,113 @@ class STFT(object):
             stft_r = np.log(np.maximum(stft_r,min_z))
         return stft_r
 
-    def istft(self, stft_samp):
+    def istft(self, stft_samp, length=None):
+        if self.backend == 'torch':
+            return self._torch_io(self._torch_istft, stft_samp, length)
         stft_samp = np.transpose(stft_samp)
         output = librosa.istft(stft_samp, hop_length=self.hop_length,
                                win_length=self.window_length, window=self.window,center=self.center)
         return output
 
+    def _torch_io(self, func, samp, *args):
+        # numpy in -> numpy out, tensor in -> tensor out
+        if isinstance(samp, torch.Tensor):
+            return func(samp, *args)
+        return func(torch.from_numpy(np.asarray(samp)), *args).numpy()
+
+    def _get_window(self, device):
+        if self._window is None or self._window.device != device:
+            # same periodic window (padded to nfft) as librosa
+            window = get_window(self.window, self.window_length, fftbins=True)
+            window = librosa.util.pad_center(window, size=self.nfft)
+            self._window = torch.tensor(window, dtype=torch.float32, device=device)
+        return self._window
+
+    def _torch_stft(self, samp, is_mag, is_log):
+        '''
+           samp: T or B x T
+           return: T x F or B x T x F
+        '''
+        if not samp.is_complex():
+            samp = samp.float()
+        stft_r = torch.stft(samp, n_fft=self.nfft, hop_length=self.hop_length,
+                            win_length=self.nfft, window=self._get_window(samp.device),
+                            center=self.center, pad_mode='reflect', return_complex=True)
+        stft_r = stft_r.transpose(-1, -2)
+        if is_mag:
+            stft_r = torch.abs(stft_r)
+        if is_log:
+            min_z = np.finfo(float).eps
+            stft_r = torch.log(torch.clamp(stft_r, min=min_z))
+        return stft_r
+
+    def _torch_istft(self, stft_samp, length=None):
+        '''
+           stft_samp: T x F or B x T x F complex
+           return: samples, T or B x T
+
+           overlap-add written out instead of torch.istft, which refuses
+           non-centered hann frames (zero window sum at the edges),
+           normalized where the window sum is non-zero like librosa.
+           Computed in float64: near the edges of non-centered frames the
+           window sum is close to zero and would amplify float32 rounding.
+        '''
+        is_batch = stft_samp.dim() == 3
+        if not is_batch:
+            stft_samp = stft_samp.unsqueeze(0)
+        dtype = torch.float64 if stft_samp.dtype == torch.complex128 else torch.float32
+        stft_samp = stft_samp.to(torch.complex128)
+        B, T, _ = stft_samp.shape
+        window = self._get_window(stft_samp.device).double()
+        # B x T x nfft
+        frames = torch.fft.irfft(stft_samp, n=self.nfft, dim=-1) * window
+        n = self.nfft + self.hop_length * (T - 1)
+        output = F.fold(frames.transpose(1, 2), output_size=(1, n),
+                        kernel_size=(1, self.nfft), stride=(1, self.hop_length)).view(B, n)
+        window_sum = F.fold((window**2).view(1, -1, 1).expand(1, -1, T), output_size=(1, n),
+                            kernel_size=(1, self.nfft), stride=(1, self.hop_length)).view(n)
+        nonzero = window_sum > torch.finfo(dtype).tiny
+        output[:, nonzero] = output[:, nonzero] / window_sum[nonzero]
+        start = self.nfft // 2 if self.center else 0
+        if length is None:
+            end = n - self.nfft // 2 if self.center else n
+            output = output[:, start:end]
+        else:
+            output = output[:, start:start+length]
+            if output.shape[1] < length:
+                output = F.pad(output, (0, length - output.shape[1]))
+        output = output.to(dtype)
+        return output if is_batch else output[0]
+
+
+def compare_backends(samp, **kwargs):
+    '''
+       largest absolute differences between the librosa and the torch
+       backend on one utterance: (stft, log magnitude, istft)
+    '''
+    librosa_stft = STFT(backend='librosa', **kwargs)
+    torch_stft = STFT(backend='torch', **kwargs)
+    spec = librosa_stft.stft(samp)
+    stft_diff = np.max(np.abs(spec - torch_stft.stft(samp)))
+    log_diff = np.max(np.abs(librosa_stft.stft(samp, is_mag=True, is_log=True) -
+                             torch_stft.stft(samp, is_mag=True, is_log=True)))
+    istft_diff = np.max(np.abs(librosa_stft.istft(spec, length=None) -
+                               torch_stft.istft(spec.astype(np.complex64))))
+    return stft_diff, log_diff, istft_diff
+
 
 if __name__ == "__main__":
-    samp  = util.read_wav('../1.wav')
-    stft_i = STFT()
-    stft = stft_i.stft(samp,is_mag=True,is_log=True)
-    print(stft)
+    # python utils/stft_istft.py [wav]: the torch backend against librosa,
+    # with and without centered frames
+    if len(sys.argv) > 1:
+        samp = util.read_wav(sys.argv[1])
+    else:
+        samp = np.random.RandomState(0).uniform(-0.5, 0.5, 16000).astype(np.float32)
+    for center in [False, True]:
+        diffs = compare_backends(samp, window='hann', nfft=256, window_length=256,
+                                 hop_length=64, center=center)
+        print('center={}: max difference stft {:.2e}, log magnitude {:.2e}, istft {:.2e}'.format(
+            center, *diffs))
+        if max(diffs) > 1e-3:
+            raise RuntimeError('stft backends differ with center={}'.format(center))
     
\ No newline at end of file
@@ -1,4 +1,5 @@
 import pickle
+import contextlib
 from tqdm import tqdm
 import numpy as np
 import torch
@@ -7,6 +8,7 @@ from pathlib import Path
 from collections import OrderedDict
 import librosa
 import os
+from multiprocessing import Pool
 import sys
 sys.path.append('../deep_clustering_rnn/')
 print("sys.path ", sys.path)
@@ -68,6 +70,22 @@ def read_scp(scp_file):
     return wave
 
 
+def read_manifest(manifest_file):
+    '''
+      read the manifest written by dataset/create_manifest.py
+      return {key: {stream: path, ..., 'sample_rate': int, 'channels': int, 'length': int}}
+    '''
+    with open(manifest_file, 'r') as f:
+        columns = f.readline().strip().split('\t')
+        manifest = {}
+        for line in f:
+            row = dict(zip(columns, line.strip().split('\t')))
+            for column in ('sample_rate', 'channels', 'length'):
+                row[column] = int(row[column])
+            manifest[row.pop('key')] = row
+    return manifest
+
+
 def compute_non_silent(samp, threshold=40, is_linear=True):
     '''
        samp: Spectrogram
@@ -85,32 +103,85 @@ def compute_non_silent(samp, threshold=40, is_linear=True):
     return non_silent
 
 
-def compute_cmvn(scp_file, save_file, **kwargs):
+def merge_stats(stats_a, stats_b):
+    '''
+       merge two (count, mean, M2) statistics, M2 being the sum of squared
+       deviations from the mean (Chan et al. parallel variance), stable even
+       when the mean is large compared to the std
+    '''
+    count_a, mean_a, m2_a = stats_a
+    count_b, mean_b, m2_b = stats_b
+    count = count_a + count_b
+    if count_b == 0:
+        return stats_a
+    if count_a == 0:
+        return stats_b
+    delta = mean_b - mean_a
+    mean = mean_a + delta * count_b / count
+    m2 = m2_a + m2_b + delta**2 * count_a * count_b / count
+    return count, mean, m2
+
+
+def cmvn_shard(args):
+    '''
+       (count, mean, M2) of the spectrograms of some keys of the scp
+    '''
+    scp_file, keys, kwargs = args
+    wave_reader = AudioData(scp_file, **kwargs)
+    tf_bin = int(kwargs['nfft']/2+1)
+    stats = (0, np.zeros(tf_bin), np.zeros(tf_bin))
+    for key in keys:
+        spectrogram = np.asarray(wave_reader[key], dtype=np.float64)
+        if spectrogram.shape[0] == 0:
+            continue
+        mean = np.mean(spectrogram, 0)
+        m2 = np.sum((spectrogram - mean)**2, 0)
+        stats = merge_stats(stats, (spectrogram.shape[0], mean, m2))
+    return stats
+
+
+def compute_cmvn(scp_file, save_file, num_workers=4, update=False, **kwargs):
     '''
        Feature normalization
        scp_file: the file path of scp
        save_file: the cmvn result file .ark
-       **kwargs: the configure setting of file
+       num_workers: processes computing the statistics of the scp shards
+       update: if save_file exists, only add the keys it has not seen yet
+               (e.g. utterances appended to the scp)
+       **kwargs: the configure setting of file, with cache_dir the
+                 spectrograms come from the feature cache of training
 
        return
             mean: [frequency-bins]
             var:  [frequency-bins]
     '''
-    wave_reader = AudioData(scp_file, **kwargs)
+    keys = list(read_scp(scp_file).keys())
     tf_bin = int(kwargs['nfft']/2+1)
-    mean = np.zeros(tf_bin)
-    std = np.zeros(tf_bin)
-    num_frames = 0
-    for spectrogram in tqdm(wave_reader):
-        num_frames += spectrogram.shape[0]
-        mean += np.sum(spectrogram, 0)
-        std += np.sum(spectrogram**2, 0)
-    mean = mean / num_frames
-    std = np.sqrt(std / num_frames - mean**2)
+    stats = (0, np.zeros(tf_bin), np.zeros(tf_bin))
+    done = set()
+    setting = sorted((k, str(v)) for k, v in kwargs.items() if k != 'cache_dir')
+    if update and os.path.exists(save_file):
+        cmvn_dict = pickle.load(open(save_file, 'rb'))
+        if 'count' not in cmvn_dict or cmvn_dict['setting'] != setting:
+            raise ValueError(
+                "{} has no statistics for these settings, recompute it without update".format(save_file))
+        stats = (cmvn_dict['count'], cmvn_dict['mean'], cmvn_dict['m2'])
+        done = set(cmvn_dict['keys'])
+        keys = [key for key in keys if key not in done]
+    # several shards per worker so that the progress bar moves
+    shards = [shard.tolist() for shard in np.array_split(np.array(keys), num_workers * 8)
+              if len(shard)]
+    with Pool(num_workers) as pool:
+        for shard_stats in tqdm(pool.imap(cmvn_shard, [(scp_file, shard, kwargs) for shard in shards]),
+                                total=len(shards)):
+            stats = merge_stats(stats, shard_stats)
+    num_frames, mean, m2 = stats
+    std = np.sqrt(m2 / num_frames)
     with open(save_file, "wb") as f:
-        cmvn_dict = {"mean": mean, "std": std}
+        cmvn_dict = {"mean": mean, "std": std, "count": num_frames, "m2": m2,
+                     "keys": sorted(done.union(keys)), "setting": setting}
         pickle.dump(cmvn_dict, f)
-    print("Totally processed {} frames".format(num_frames))
+    print("Totally processed {} frames, {} new utterances".format(num_frames, len(keys)))
     print("Global mean: {}".format(mean))
     print("Global std: {}".format(std))
 
@@ -126,11 +197,29 @@ def apply_cmvn(samp, cmvn_dict):
     return (samp-cmvn_dict['mean'])/cmvn_dict['std']
 
 
+def autocast(device, precision='fp32'):
+    '''
+      context of the forward pass for a precision
+      device: torch.device (or str) of the model
+      precision: 'fp32', or 'bf16' for bfloat16 autocast (the BLSTM and the
+                 linear layer run in bf16), compute the Loss after leaving
+                 the context, it casts the embeddings to fp32
+    '''
+    if precision == 'fp32':
+        return contextlib.nullcontext()
+    if precision != 'bf16':
+        raise ValueError('Unsupported precision {}, fp32 or bf16'.format(precision))
+    if not hasattr(torch, 'autocast'):
+        raise RuntimeError('bf16 autocast needs torch >= 1.10')
+    return torch.autocast(device_type=torch.device(device).type, dtype=torch.bfloat16)
+
+
 if __name__ == "__main__":
     kwargs = {'window': 'hann', 'nfft': 256, 'window_length': 256,
-              'hop_length': 64, 'center': False, 'is_mag': True, 'is_log': True}
+              'hop_length': 64, 'center': False, 'is_mag': True, 'is_log': True,
+              'cache_dir': './feature_cache'}
     compute_cmvn("./tr_mix.scp",
-                 '../cmvn.ark', **kwargs)
+                 '../cmvn.ark', num_workers=os.cpu_count(), **kwargs)
     # file = pickle.load(open('cmvn.ark','rb'))
     # print(file)
     # samp = read_wav('../1.wav')
@@ -0,0 +1,52 @@
+import argparse
+import timeit
+import torch
+from export import load_model, script_model
+
+
+def compile_model(net):
+    '''
+       torch.compile version of a model, dynamic shapes so that every input
+       length does not recompile
+    '''
+    return torch.compile(net, dynamic=True)
+
+
+def latency(net, x, number):
+    '''
+       best time of number calls, in ms, after a warmup call
+    '''
+    with torch.no_grad():
+        net(x)
+        return min(timeit.repeat(lambda: net(x), number=1, repeat=number)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-yaml', type=str, default='./config/Dual_RNN/train_rnn.yml', help='Path to yaml file.')
+    parser.add_argument(
+        '-model', type=str, default=None, help="Path to model file, random weights if not given.")
+    parser.add_argument(
+        '-seconds', type=float, nargs='+', default=[0.5, 2, 4, 8], help='Input lengths at 8 kHz.')
+    parser.add_argument(
+        '-number', type=int, default=5, help='Timed calls per length, the best one is reported.')
+    parser.add_argument(
+        '-no_compile', action='store_true', help='Skip torch.compile.')
+    args = parser.parse_args()
+    net = load_model(args.yaml, args.model)
+    models = [('eager', net), ('script', script_model(net))]
+    if not args.no_compile:
+        models.append(('compile', compile_model(net)))
+    print('{:d} threads'.format(torch.get_num_threads()))
+    print('{:>8} '.format('len (s)') + ' '.join('{:>10}'.format(name + ' ms') for name, _ in models)
+          + ' ' + ' '.join('{:>10}'.format(name + ' x') for name, _ in models[1:]))
+    for seconds in args.seconds:
+        x = torch.randn(1, int(seconds * 8000))
+        times = [latency(model, x, args.number) for _, model in models]
+        print('{:>8.1f} '.format(seconds) + ' '.join('{:>10.1f}'.format(t) for t in times)
+              + ' ' + ' '.join('{:>10.2f}'.format(times[0] / t) for t in times[1:]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import copy
+import math
+import time
+import argparse
+import timeit
+import torch
+from data_loader.AudioReader import AudioReader
+from export import load_model
+from model.loss import Loss
+from config.option import parse
+from utils.util import autocast
+
+
+def synthetic_batch(batch, length, num_spks, seed):
+    '''
+       Mixtures of num_spks sources, every source a few harmonic tones with
+       random pitch and a random amplitude envelope, the same for a seed
+       output: mix [B, T], refs num_spks x [B, T]
+    '''
+    generator = torch.Generator().manual_seed(seed)
+    t = torch.arange(length, dtype=torch.float32) / 8000
+    refs = []
+    for _ in range(num_spks):
+        f0 = 100 + 300 * torch.rand(batch, 1, 1, generator=generator)
+        harmonics = torch.arange(1, 4, dtype=torch.float32)[None, :, None]
+        phase = 2 * math.pi * torch.rand(batch, 3, 1, generator=generator)
+        tones = torch.sin(2 * math.pi * f0 * harmonics * t + phase) / harmonics
+        rate = 1 + 3 * torch.rand(batch, 1, generator=generator)
+        envelope = 0.55 + 0.45 * torch.sin(2 * math.pi * rate * t)
+        refs.append(tones.sum(1) * envelope)
+    return sum(refs), refs
+
+
+def scp_batch(mix, refs, batch, length, step):
+    '''
+       batch utterances of scp readers (looping over them), cut or zero
+       padded to length samples
+    '''
+    def crop(x):
+        return torch.nn.functional.pad(x[:length], (0, max(0, length - x.shape[0])))
+    keys = [mix.keys[(step * batch + b) % len(mix)] for b in range(batch)]
+    return (torch.stack([crop(mix[key]) for key in keys]),
+            [torch.stack([crop(ref[key]) for key in keys]) for ref in refs])
+
+
+def train_curve(net, precision, batches, opt):
+    '''
+       Train a copy of net on the batches
+       output: loss of every step, seconds of every step
+    '''
+    net = copy.deepcopy(net).train()
+    optimizer = torch.optim.Adam(net.parameters(), lr=opt['optim']['lr'])
+    losses, seconds = [], []
+    for mix, refs in batches:
+        start = time.time()
+        optimizer.zero_grad()
+        with autocast('cpu', precision):
+            out = net(mix)
+        loss = Loss(out, refs)
+        loss.backward()
+        if opt['optim']['clip_norm']:
+            torch.nn.utils.clip_grad_norm_(net.parameters(), opt['optim']['clip_norm'])
+        optimizer.step()
+        seconds.append(time.time() - start)
+        losses.append(loss.item())
+    return losses, seconds
+
+
+def latency(net, precision, x, number):
+    '''
+       best time of number calls, in ms, after a warmup call
+    '''
+    def forward():
+        with torch.no_grad(), autocast('cpu', precision):
+            return net(x)
+    forward()
+    return min(timeit.repeat(forward, number=1, repeat=number)) * 1000
+
+
+def mean(values):
+    return sum(values) / max(len(values), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-yaml', type=str, default='./config/Dual_RNN/train_rnn.yml', help='Path to yaml file.')
+    parser.add_argument(
+        '-model', type=str, default=None, help="Path to model file, random weights if not given.")
+    parser.add_argument(
+        '-seconds', type=float, nargs='+', default=[0.5, 2, 4], help='Inference input lengths at 8 kHz.')
+    parser.add_argument(
+        '-number', type=int, default=5, help='Timed inference calls per length, the best one is reported.')
+    parser.add_argument(
+        '-steps', type=int, default=100, help='Training steps of the convergence check, 0 to skip it.')
+    parser.add_argument(
+        '-batch', type=int, default=2, help='Batch size of the training steps.')
+    parser.add_argument(
+        '-train_seconds', type=float, default=1, help='Length of the training examples.')
+    parser.add_argument(
+        '-mix_scp', type=str, default=None, help='Train on this scp instead of synthetic mixtures.')
+    parser.add_argument(
+        '-ref_scp', type=str, nargs='+', default=['./tr_s1.scp', './tr_s2.scp'],
+        help='Reference scp files of -mix_scp, one per speaker.')
+    parser.add_argument(
+        '-tolerance', type=float, default=0.5,
+        help='Largest gap in dB between the final fp32 and bf16 losses that counts as matching.')
+    args = parser.parse_args()
+    opt = parse(args.yaml)
+    net = load_model(args.yaml, args.model)
+    print('{:d} threads, {}'.format(torch.get_num_threads(), args.yaml))
+
+    print('{:>8} {:>10} {:>10} {:>10}'.format('len (s)', 'fp32 ms', 'bf16 ms', 'bf16 x'))
+    for seconds in args.seconds:
+        x = torch.randn(1, int(seconds * 8000))
+        fp32, bf16 = (latency(net, precision, x, args.number) for precision in ('fp32', 'bf16'))
+        print('{:>8.1f} {:>10.1f} {:>10.1f} {:>10.2f}'.format(seconds, fp32, bf16, fp32 / bf16))
+
+    if not args.steps:
+        return
+    length = int(args.train_seconds * 8000)
+    if args.mix_scp is not None:
+        mix = AudioReader(args.mix_scp, sample_rate=8000)
+        refs = [AudioReader(scp, sample_rate=8000) for scp in args.ref_scp]
+        batches = [scp_batch(mix, refs, args.batch, length, step) for step in range(args.steps)]
+    else:
+        batches = [synthetic_batch(args.batch, length, net.num_spks, step) for step in range(args.steps)]
+    # same initial weights and batches for both precisions
+    curves = {precision: train_curve(net, precision, batches, opt) for precision in ('fp32', 'bf16')}
+    print('{:>8} {:>10} {:>10}'.format('step', 'fp32 loss', 'bf16 loss'))
+    window = max(args.steps // 10, 1)
+    for end in range(window, args.steps + 1, window):
+        fp32, bf16 = (mean(curves[p][0][end - window:end]) for p in ('fp32', 'bf16'))
+        print('{:>8d} {:>10.3f} {:>10.3f}'.format(end, fp32, bf16))
+    # the first step includes one-time setup
+    fp32_step, bf16_step = (mean(curves[p][1][1:]) for p in ('fp32', 'bf16'))
+    print('train step fp32 {:.1f} ms, bf16 {:.1f} ms, {:.2f}x, {:.1f} vs {:.1f} examples/s'.format(
+        fp32_step * 1000, bf16_step * 1000, fp32_step / bf16_step,
+        args.batch / fp32_step, args.batch / bf16_step))
+    gap = mean(curves['bf16'][0][-window:]) - mean(curves['fp32'][0][-window:])
+    print('final loss gap bf16 - fp32 {:+.3f} dB: {}'.format(
+        gap, 'matches' if abs(gap) <= args.tolerance else 'DIFFERS, beyond {:.2f} dB'.format(args.tolerance)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import argparse
+import timeit
+import torch
+from torch.autograd import profiler
+from model.model_rnn import Dual_Path_RNN
+
+
+def reference_segmentation(input, K):
+    '''
+       Segmentation as it was, with torch.cat padding and .contiguous() copies
+       input: [B, N, L]
+       output: [B, N, K, S], gap
+    '''
+    B, N, L = input.shape
+    P = K // 2
+    gap = K - (P + L % K) % K
+    if gap > 0:
+        pad = input.new_zeros(B, N, gap)
+        input = torch.cat([input, pad], dim=2)
+    _pad = input.new_zeros(B, N, P)
+    input = torch.cat([_pad, input, _pad], dim=2)
+    input1 = input[:, :, :-P].contiguous().view(B, N, -1, K)
+    input2 = input[:, :, P:].contiguous().view(B, N, -1, K)
+    input = torch.cat([input1, input2], dim=3).view(
+        B, N, -1, K).transpose(2, 3)
+    return input.contiguous(), gap
+
+
+def reference_over_add(input, gap):
+    '''
+       Overlap-add as it was
+       input: [B, N, K, S]
+       output: [B, N, L]
+    '''
+    B, N, K, S = input.shape
+    P = K // 2
+    input = input.transpose(2, 3).contiguous().view(B, N, -1, K * 2)
+    input1 = input[:, :, :, :K].contiguous().view(B, N, -1)[:, :, P:]
+    input2 = input[:, :, :, K:].contiguous().view(B, N, -1)[:, :, :-P]
+    input = input1 + input2
+    if gap > 0:
+        input = input[:, :, :-gap]
+    return input
+
+
+def allocations(fn):
+    '''
+       number and MB of the cpu allocations of one call
+    '''
+    with profiler.profile(profile_memory=True) as prof:
+        fn()
+    sizes = [getattr(e, 'self_cpu_memory_usage', e.cpu_memory_usage)
+             for e in prof.function_events]
+    sizes = [s for s in sizes if s > 0]
+    return len(sizes), sum(sizes) / 2**20
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-length', type=int, default=32000, help='L, frames of the encoder output.')
+    parser.add_argument('-channels', type=int, default=256, help='N, feature channels.')
+    parser.add_argument('-K', type=int, default=250, help='Chunk length.')
+    parser.add_argument('-batch', type=int, default=1, help='B, batch size.')
+    parser.add_argument('-number', type=int, default=20, help='Timed calls, the best one is reported.')
+    args = parser.parse_args()
+    separation = Dual_Path_RNN(args.channels, args.channels, args.channels, K=args.K)
+    x = torch.randn(args.batch, args.channels, args.length)
+    K = args.K
+
+    chunks, gap = separation._Segmentation(x, K)
+    ref_chunks, ref_gap = reference_segmentation(x, K)
+    if not torch.equal(chunks, ref_chunks) or gap != ref_gap:
+        raise RuntimeError('Segmentation differs from the reference')
+    if not torch.equal(separation._over_add(ref_chunks, gap), reference_over_add(ref_chunks, gap)):
+        raise RuntimeError('Overlap-add differs from the reference')
+
+    stages = [('segmentation', lambda: reference_segmentation(x, K), lambda: separation._Segmentation(x, K)),
+              ('over_add', lambda: reference_over_add(ref_chunks, gap), lambda: separation._over_add(ref_chunks, gap))]
+    print('{:d} threads, B={:d} N={:d} L={:d} K={:d}, outputs identical'.format(
+        torch.get_num_threads(), args.batch, args.channels, args.length, K))
+    print('{:>14} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+        'stage', 'old ms', 'new ms', 'old alloc', 'new alloc', 'old MB', 'new MB'))
+    with torch.no_grad():
+        for name, old, new in stages:
+            times = [min(timeit.repeat(fn, number=1, repeat=args.number)) * 1000 for fn in (old, new)]
+            (old_count, old_mb), (new_count, new_mb) = allocations(old), allocations(new)
+            print('{:>14} {:>10.2f} {:>10.2f} {:>10d} {:>10d} {:>10.1f} {:>10.1f}'.format(
+                name, times[0], times[1], old_count, new_count, old_mb, new_mb))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@ import torch.nn.functional as F
 from utils import util
 import torch
 import torchaudio
+import soundfile as sf
 import sys
 sys.path.append('../')
 
@@ -38,6 +39,66 @@ def write_wav(fname, src, sample_rate):
     torchaudio.save(fname, src, sample_rate)
 
 
+def wav_length(fname):
+    '''
+         Number of audio frames of a wav file, read from its header only
+    '''
+    return sf.info(fname).frames
+
+
+def read_wav_range(fname, start, size):
+    '''
+         Read `size` frames starting at frame `start` without decoding
+         the rest of the file
+         output:
+                src: output tensor of size L
+    '''
+    src, _ = sf.read(fname, start=start, stop=start+size, dtype='float32')
+    return torch.from_numpy(src)
+
+
+def chunk_spans(length, chunk_size=32000, least_size=16000):
+    '''
+        Chunks cut from an utterance of `length` samples
+        input:
+              length: number of samples of the utterance
+              chunk_size: split audio size, or a list of sizes, then every
+                          utterance is split with the largest size it fits
+              least_size: minimum split size, also the hop between chunks
+        output:
+              list of (start, size), a chunk shorter than chunk_size
+              is zero padded to chunk_size when it is read
+    '''
+    spans = []
+    if length < least_size:
+        return spans
+    sizes = chunk_size if isinstance(chunk_size, (list, tuple)) else [chunk_size]
+    fits = [size for size in sizes if size <= length]
+    if not fits:
+        if length > least_size:
+            spans.append((0, length))
+        return spans
+    chunk_size = max(fits)
+    start = 0
+    while True:
+        if start + chunk_size > length:
+            break
+        spans.append((start, chunk_size))
+        start += least_size
+    return spans
+
+
+def read_chunk(utt, start, size, chunk_size):
+    '''
+        Slice one chunk from utt and zero pad it to chunk_size,
+        chunk_size None keeps the chunk at its own size
+    '''
+    chunk = utt[start:start+size]
+    if chunk_size is not None and size < chunk_size:
+        chunk = F.pad(chunk, (0, chunk_size-size), mode='constant')
+    return chunk
+
+
 class AudioReader(object):
     '''
         Class that reads Wav format files
@@ -46,19 +107,68 @@ class AudioReader(object):
             sample_rate (int, optional): sample rate (default: 8000)
             chunk_size (int, optional): split audio size (default: 32000(4 s))
             least_size (int, optional): Minimum split size (default: 16000(2 s))
+            lazy (bool, optional): only read the wav headers to build a
+                                   (key, start, size) chunk index and read each
+                                   chunk on demand in __getitem__ (default: False)
+            pad (bool, optional): zero pad short chunks to chunk_size, False
+                                  keeps variable chunk sizes for dynamic
+                                  batching and allows a list of chunk sizes
+                                  (default: True)
+            lengths (dict, optional): number of samples of every key, e.g. from
+                                      a manifest, so that the lazy index reads
+                                      no wav header (default: None)
         Output:
-            split audio (list)
+            split audio (list), or the reader itself when lazy
     '''
 
-    def __init__(self, scp_path, sample_rate=8000, chunk_size=32000, least_size=16000):
+    def __init__(self, scp_path, sample_rate=8000, chunk_size=32000, least_size=16000, lazy=False, pad=True, lengths=None):
         super(AudioReader, self).__init__()
         self.sample_rate = sample_rate
         self.index_dict = util.handle_scp(scp_path)
         self.keys = list(self.index_dict.keys())
         self.audio = []
+        self.index = []
         self.chunk_size = chunk_size
         self.least_size = least_size
-        self.split()
+        self.lazy = lazy
+        self.lengths_dict = lengths
+        if pad and isinstance(chunk_size, (list, tuple)):
+            raise ValueError('A list of chunk sizes needs pad=False (dynamic batching)')
+        self.pad_size = chunk_size if pad else None
+        if lazy:
+            self.build_index()
+        else:
+            self.split()
+
+    def build_index(self):
+        '''
+            same chunks as split, but only their positions are kept
+        '''
+        for key in self.keys:
+            if self.lengths_dict is not None:
+                length = self.lengths_dict[key]
+            else:
+                length = wav_length(self.index_dict[key])
+            for start, size in chunk_spans(length, self.chunk_size, self.least_size):
+                self.index.append((key, start, size))
+
+    def __len__(self):
+        return len(self.index) if self.lazy else len(self.audio)
+
+    def lengths(self):
+        '''
+            size of every chunk, as returned by __getitem__
+        '''
+        if not self.lazy:
+            return [a.shape[0] for a in self.audio]
+        return [self.pad_size or size for _, _, size in self.index]
+
+    def __getitem__(self, index):
+        if not self.lazy:
+            return self.audio[index]
+        key, start, size = self.index[index]
+        utt = read_wav_range(self.index_dict[key], start, size)
+        return read_chunk(utt, 0, size, self.pad_size)
 
     def split(self):
         '''
@@ -66,19 +176,8 @@ class AudioReader(object):
         '''
         for key in self.keys:
             utt = read_wav(self.index_dict[key])
-            if utt.shape[0] < self.least_size:
-                continue
-            if utt.shape[0] > self.least_size and utt.shape[0] < self.chunk_size:
-                gap = self.chunk_size-utt.shape[0]
-                self.audio.append(F.pad(utt, (0, gap), mode='constant'))
-            if utt.shape[0] >= self.chunk_size:
-                start = 0
-                while True:
-                    if start + self.chunk_size > utt.shape[0]:
-                        break
-                    self.audio.append(utt[start:start+self.chunk_size])
-                    start += self.least_size
-
+            for start, size in chunk_spans(utt.shape[0], self.chunk_size, self.least_size):
+                self.audio.append(read_chunk(utt, start, size, self.pad_size))
 
 
 if __name__ == "__main__":
@@ -2,6 +2,7 @@ import sys
 sys.path.append('../')
 import torchaudio
 import torch
+import soundfile as sf
 from utils.util import handle_scp
 
 
@@ -60,6 +61,12 @@ class AudioReader(object):
     def __len__(self):
         return len(self.keys)
 
+    def lengths(self):
+        '''
+           Number of samples of every utterance, read from the wav headers
+        '''
+        return [sf.info(self.index_dict[key]).frames for key in self.keys]
+
     def __iter__(self):
         for key in self.keys:
             yield key, self._load(key)
@@ -0,0 +1,110 @@
+import sys
+sys.path.append('../')
+
+import hashlib
+import os
+import numpy as np
+import torch
+from utils import util
+from data_loader.AudioData import read_wav, chunk_spans, read_chunk
+
+
+def store_name(scp_path, sample_rate, chunk_size, least_size, pad):
+    '''
+         Name of the chunk store of one scp file
+         The hash covers the scp content, the size and modification time
+         of every wav and the chunk settings, so changing any of them builds
+         a new store instead of reusing a stale one
+    '''
+    sha = hashlib.sha1()
+    with open(scp_path, 'rb') as f:
+        sha.update(f.read())
+    for path in util.handle_scp(scp_path).values():
+        stat = os.stat(path)
+        sha.update('{}_{}'.format(stat.st_size, stat.st_mtime_ns).encode())
+    sha.update('{}_{}_{}_{}'.format(sample_rate, chunk_size, least_size, pad).encode())
+    name = os.path.splitext(os.path.basename(scp_path))[0]
+    return '{}_{}'.format(name, sha.hexdigest()[:16])
+
+
+class ChunkStore(object):
+    '''
+        On-disk, memory-mapped version of AudioReader.audio
+        All chunks of a scp file are written once into one contiguous float32
+        buffer (<name>.bin) plus an offsets index (<name>.idx.npy), chunk i is
+        data[offsets[i]:offsets[i+1]]. Later runs with the same scp and chunk
+        settings reuse the files, and DataLoader workers share the page cache
+        instead of holding their own copy of every chunk.
+        Input:
+            scp_path (str): a different scp file address
+            cache_dir (str): directory where the store is kept
+            sample_rate (int, optional): sample rate (default: 8000)
+            chunk_size (int, optional): split audio size (default: 32000(4 s))
+            least_size (int, optional): Minimum split size (default: 16000(2 s))
+            pad (bool, optional): zero pad short chunks to chunk_size (default: True)
+        Output:
+            chunk tensor, a zero-copy view of the mapped buffer
+    '''
+
+    def __init__(self, scp_path, cache_dir, sample_rate=8000, chunk_size=32000, least_size=16000, pad=True):
+        super(ChunkStore, self).__init__()
+        self.sample_rate = sample_rate
+        self.chunk_size = chunk_size
+        self.least_size = least_size
+        if pad and isinstance(chunk_size, (list, tuple)):
+            raise ValueError('A list of chunk sizes needs pad=False (dynamic batching)')
+        self.pad_size = chunk_size if pad else None
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, store_name(
+            scp_path, sample_rate, chunk_size, least_size, pad))
+        if not os.path.exists(self.path + '.idx.npy'):
+            self.build(scp_path)
+        self.offsets = np.load(self.path + '.idx.npy')
+        # mapped lazily so that every DataLoader worker opens its own mapping
+        self.data = None
+
+    def build(self, scp_path):
+        '''
+            decode the scp once and append every chunk to the buffer
+            both files are written under a temporary name and renamed,
+            the index last, so an interrupted build is never reused
+        '''
+        index_dict = util.handle_scp(scp_path)
+        offsets = [0]
+        with open(self.path + '.bin.tmp', 'wb') as f:
+            for key in index_dict:
+                utt = read_wav(index_dict[key])
+                for start, size in chunk_spans(utt.shape[0], self.chunk_size, self.least_size):
+                    chunk = read_chunk(utt, start, size, self.pad_size)
+                    f.write(chunk.numpy().astype(np.float32).tobytes())
+                    offsets.append(offsets[-1] + chunk.shape[0])
+        os.replace(self.path + '.bin.tmp', self.path + '.bin')
+        np.save(self.path + '.idx.tmp.npy', np.array(offsets, dtype=np.int64))
+        os.replace(self.path + '.idx.tmp.npy', self.path + '.idx.npy')
+
+    def _map(self):
+        if self.offsets[-1] == 0:
+            return np.zeros(0, dtype=np.float32)
+        # copy-on-write mapping: pages stay shared until written
+        return np.memmap(self.path + '.bin', dtype=np.float32, mode='c')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def lengths(self):
+        return np.diff(self.offsets).tolist()
+
+    def __getitem__(self, index):
+        if self.data is None:
+            self.data = self._map()
+        return torch.from_numpy(self.data[self.offsets[index]:self.offsets[index+1]])
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['data'] = None
+        return state
+
+
+if __name__ == "__main__":
+    store = ChunkStore("/home/likai/data1/create_scp/cv_mix.scp", './chunk_store')
+    print(len(store))
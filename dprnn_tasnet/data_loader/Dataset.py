@@ -2,8 +2,11 @@ import sys
 sys.path.append('../')
 
 from data_loader.AudioData import AudioReader
+from data_loader.ChunkStore import ChunkStore
+from utils import util
 import torch
-from torch.utils.data import Dataset
+import torch.nn.functional as F
+from torch.utils.data import Dataset, Sampler
 
 import numpy as np
 
@@ -15,14 +18,39 @@ class Datasets(Dataset):
        ref_scp: file path of ground truth audio (type: list[spk1,spk2])
        chunk_size (int, optional): split audio size (default: 32000(4 s))
        least_size (int, optional): Minimum split size (default: 16000(2 s))
+       cache_dir (str, optional): if set, chunks are read from memory-mapped
+                                  ChunkStore files in this directory instead
+                                  of being kept in RAM (default: None)
+       lazy (bool, optional): build the chunk index from the wav headers and
+                              read every chunk on demand, takes precedence
+                              over cache_dir (default: False)
+       dynamic (bool, optional): keep chunks at their own size instead of
+                                 zero padding them to chunk_size, for use with
+                                 TokenBudgetBatchSampler and pad_collate.
+                                 chunk_size may then be a list of sizes
+                                 (default: False)
+       manifest (str, optional): manifest of the split written by
+                                 create_scp.py, the lazy index then takes the
+                                 lengths from it instead of the wav headers
+                                 (default: None)
     '''
 
-    def __init__(self, mix_scp=None, ref_scp=None, sample_rate=8000, chunk_size=32000, least_size=16000):
+    def __init__(self, mix_scp=None, ref_scp=None, sample_rate=8000, chunk_size=32000, least_size=16000, cache_dir=None, lazy=False, dynamic=False, manifest=None):
         super(Datasets, self).__init__()
-        self.mix_audio = AudioReader(
-            mix_scp, sample_rate=sample_rate, chunk_size=chunk_size, least_size=least_size).audio
-        self.ref_audio = [AudioReader(
-            r, sample_rate=sample_rate, chunk_size=chunk_size, least_size=least_size).audio for r in ref_scp]
+        kwargs = dict(sample_rate=sample_rate, chunk_size=chunk_size,
+                      least_size=least_size, pad=not dynamic)
+        if lazy:
+            if manifest:
+                kwargs['lengths'] = {key: row['length'] for key, row in
+                                     util.handle_manifest(manifest).items()}
+            self.mix_audio = AudioReader(mix_scp, lazy=True, **kwargs)
+            self.ref_audio = [AudioReader(r, lazy=True, **kwargs) for r in ref_scp]
+        elif cache_dir:
+            self.mix_audio = ChunkStore(mix_scp, cache_dir, **kwargs)
+            self.ref_audio = [ChunkStore(r, cache_dir, **kwargs) for r in ref_scp]
+        else:
+            self.mix_audio = AudioReader(mix_scp, **kwargs).audio
+            self.ref_audio = [AudioReader(r, **kwargs).audio for r in ref_scp]
 
     def __len__(self):
         return len(self.mix_audio)
@@ -30,6 +58,83 @@ class Datasets(Dataset):
     def __getitem__(self, index):
         return self.mix_audio[index], [ref[index] for ref in self.ref_audio]
 
+    def lengths(self):
+        '''
+           number of samples of every chunk
+        '''
+        if isinstance(self.mix_audio, list):
+            return [a.shape[0] for a in self.mix_audio]
+        return self.mix_audio.lengths()
+
+
+class TokenBudgetBatchSampler(Sampler):
+    '''
+       Batch sampler that packs chunks of similar size into batches whose
+       padded size (batch size x longest chunk) stays under max_tokens samples
+       lengths: number of samples of every chunk (Datasets.lengths())
+       max_tokens: sample budget of one padded batch
+       shuffle: shuffle chunks of equal size and the order of the batches
+       long_alone: chunks longer than max_tokens get a batch of their own
+                   instead of raising (inference on whole utterances)
+       max_spread: if set, the longest chunk of a batch is at most
+                   max_spread times its shortest, which caps the padding
+    '''
+
+    def __init__(self, lengths, max_tokens, shuffle=True, long_alone=False, max_spread=None):
+        self.lengths = np.array(lengths)
+        self.max_tokens = max_tokens
+        self.shuffle = shuffle
+        self.max_spread = max_spread
+        if not long_alone and len(self.lengths) and self.lengths.max() > max_tokens:
+            raise ValueError('max_tokens {:d} is smaller than the longest chunk {:d}'.format(
+                max_tokens, self.lengths.max()))
+        self.batches = self._pack(np.arange(len(self.lengths)))
+
+    def _pack(self, order):
+        # stable sort keeps the (shuffled) order among chunks of equal size
+        order = order[np.argsort(self.lengths[order], kind='stable')]
+        batches = []
+        batch = []
+        for index in order:
+            # sorted ascending, so the new chunk is the longest of the batch
+            # (a chunk over max_tokens always ends up alone)
+            if batch and ((len(batch) + 1) * self.lengths[index] > self.max_tokens or
+                          (self.max_spread and
+                           self.lengths[index] > self.max_spread * self.lengths[batch[0]])):
+                batches.append(batch)
+                batch = []
+            batch.append(int(index))
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __iter__(self):
+        batches = self.batches
+        if self.shuffle:
+            batches = self._pack(torch.randperm(len(self.lengths)).numpy())
+            batches = [batches[i] for i in torch.randperm(len(batches)).tolist()]
+        for batch in batches:
+            yield batch
+
+
+def pad_collate(batch):
+    '''
+       Collate chunks of different sizes
+       input: list of (mix, [ref1, ref2])
+       output: mix [B, T], [ref1 [B, T], ref2 [B, T]], lengths [B]
+               zero padded to the longest chunk of the batch
+    '''
+    lengths = torch.tensor([mix.shape[0] for mix, _ in batch], dtype=torch.long)
+    T = int(lengths.max())
+    mix = torch.stack([F.pad(mix, (0, T - mix.shape[0])) for mix, _ in batch])
+    num_spks = len(batch[0][1])
+    refs = [torch.stack([F.pad(ref[i], (0, T - ref[i].shape[0])) for _, ref in batch])
+            for i in range(num_spks)]
+    return mix, refs, lengths
+
 
 if __name__ == "__main__":
     dataset = Datasets("/home/likai/data1/create_scp/cv_mix.scp",
@@ -0,0 +1,146 @@
+import sys
+sys.path.append('../')
+
+import os
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+
+# the mixing steps of dataset/create_librimix_from_metadata.py, without its
+# dependencies (pandas, scipy, ...)
+def loudness_normalize(sources_list, gain_list):
+    '''
+       scale every source by its gain
+    '''
+    return [source * gain for source, gain in zip(sources_list, gain_list)]
+
+
+def fit_lengths(source_list, mode):
+    '''
+       'min' crops every source to the shortest one, 'max' zero pads them
+       to the longest
+    '''
+    if mode == 'min':
+        target_length = min(len(source) for source in source_list)
+        return [source[:target_length] for source in source_list]
+    target_length = max(len(source) for source in source_list)
+    return [np.pad(source, (0, target_length - len(source)), mode='constant')
+            for source in source_list]
+
+
+def mix(sources_list):
+    '''
+       sum of the sources
+    '''
+    mixture = np.zeros_like(sources_list[0])
+    for source in sources_list:
+        mixture += source
+    return mixture
+
+
+class DynamicMix(Dataset):
+    '''
+       Mix random utterances of different speakers on the fly
+       Sources are read from the store written by dataset/create_source_store.py
+       (one memory-mapped float32 file, already resampled), so every item is a
+       few slices and additions and no mixture is ever written to disk.
+       store_dir: directory of sources.bin and sources.idx.npz (type: str)
+       num_spks (int, optional): sources per mixture (default: 2)
+       epoch_size (int, optional): mixtures drawn per epoch (default: 20000)
+       sample_rate (int, optional): must match the store (default: 8000)
+       chunk_size (int, optional): mixture size (default: 32000(4 s))
+       least_size (int, optional): shorter utterances are not used (default: 16000(2 s))
+       gain_range (list, optional): level of every source in dBFS, drawn
+                                    uniformly (default: [-33, -25])
+       mode (str, optional): 'min' crops every source to the shortest one,
+                             'max' zero pads to the longest (default: 'max')
+       Output:
+           mix [chunk_size], [ref1 [chunk_size], ref2 [chunk_size]]
+    '''
+
+    def __init__(self, store_dir, num_spks=2, epoch_size=20000, sample_rate=8000,
+                 chunk_size=32000, least_size=16000, gain_range=(-33, -25), mode='max'):
+        super(DynamicMix, self).__init__()
+        self.path = os.path.join(store_dir, 'sources.bin')
+        index = np.load(os.path.join(store_dir, 'sources.idx.npz'))
+        if int(index['sample_rate']) != sample_rate:
+            raise ValueError('Source store is at {:d} Hz, not {:d} Hz'.format(
+                int(index['sample_rate']), sample_rate))
+        self.num_spks = num_spks
+        self.epoch_size = epoch_size
+        self.chunk_size = chunk_size
+        self.gain_range = gain_range
+        self.mode = mode
+        self.offsets = index['offsets']
+        lengths = np.diff(self.offsets)
+        # utterances of every speaker, short utterances left out
+        speakers = {}
+        for i, spk in enumerate(index['speakers']):
+            if lengths[i] >= least_size:
+                speakers.setdefault(spk, []).append(i)
+        self.speakers = [np.array(utts) for utts in speakers.values()]
+        if len(self.speakers) < num_spks:
+            raise ValueError('Source store has {:d} speakers, {:d} are needed'.format(
+                len(self.speakers), num_spks))
+        # mapped and seeded lazily, once per DataLoader worker
+        self.data = None
+        self.rng = None
+        self.seed = None
+
+    def __len__(self):
+        return self.epoch_size
+
+    def lengths(self):
+        return [self.chunk_size] * self.epoch_size
+
+    def _random(self):
+        # DataLoader seeds torch differently in every worker and every epoch
+        if self.seed != torch.initial_seed():
+            self.seed = torch.initial_seed()
+            self.rng = np.random.RandomState(self.seed % 2**32)
+            self.data = np.memmap(self.path, dtype=np.float32, mode='r')
+        return self.rng
+
+    def read_source(self, utt):
+        '''
+           random chunk_size crop of one utterance, as a float32 copy
+        '''
+        start, end = self.offsets[utt], self.offsets[utt+1]
+        if end - start > self.chunk_size:
+            start += self.rng.randint(end - start - self.chunk_size + 1)
+            end = start + self.chunk_size
+        return np.array(self.data[start:end])
+
+    def __getitem__(self, index):
+        rng = self._random()
+        spks = rng.choice(len(self.speakers), self.num_spks, replace=False)
+        sources = [self.read_source(rng.choice(self.speakers[s])) for s in spks]
+        # scale every source to a random level relative to its own RMS
+        levels = rng.uniform(self.gain_range[0], self.gain_range[1], self.num_spks)
+        gains = [10 ** (l / 20) / (np.sqrt(np.mean(s ** 2)) + 1e-10)
+                 for l, s in zip(levels, sources)]
+        sources = fit_lengths(loudness_normalize(sources, gains), self.mode)
+        mixture = mix(sources)
+        # avoid clipping, the sources are scaled with the mixture
+        peak = np.max(np.abs(mixture))
+        if peak > 0.9:
+            sources = [s * 0.9 / peak for s in sources]
+            mixture = mixture * 0.9 / peak
+        pad = self.chunk_size - mixture.shape[0]
+        mixture = torch.from_numpy(np.pad(mixture, (0, pad)).astype(np.float32))
+        sources = [torch.from_numpy(np.pad(s, (0, pad)).astype(np.float32)) for s in sources]
+        return mixture, sources
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['data'] = None
+        state['rng'] = None
+        state['seed'] = None
+        return state
+
+
+if __name__ == "__main__":
+    dataset = DynamicMix("/home/likai/data1/librispeech_8k")
+    mixture, sources = dataset[0]
+    print(mixture.shape, [s.shape for s in sources])
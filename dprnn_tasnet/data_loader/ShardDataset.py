@@ -0,0 +1,134 @@
+import sys
+sys.path.append('../')
+
+import io
+import os
+import tarfile
+import soundfile as sf
+import torch
+from torch.utils.data import IterableDataset, get_worker_info
+from data_loader.AudioData import chunk_spans, read_chunk
+
+
+def read_shard(path):
+    '''
+       Stream one tar shard written by create_librimix_from_metadata.py
+       --shard_size, the members of a mixture are consecutive
+       output: (mixture ID, {subdir: wav bytes}) for every mixture
+    '''
+    mix_id, group = None, {}
+    with tarfile.open(path, 'r|') as tar:
+        for member in tar:
+            subdir, filename = member.name.split('/')
+            key = os.path.splitext(filename)[0]
+            if key != mix_id and group:
+                yield mix_id, group
+                group = {}
+            mix_id = key
+            group[subdir] = tar.extractfile(member).read()
+    if group:
+        yield mix_id, group
+
+
+class ShardDataset(IterableDataset):
+    '''
+       Stream chunks from LibriMix tar shards instead of single wav files
+       Every shard is read sequentially, DataLoader workers take turns over
+       the shards, and chunks are cut as in AudioReader.split
+       shard_dir: <subset>/shards directory with index.tsv (type: str)
+       num_spks (int, optional): number of sources s1, s2, ... (default: 2)
+       mix_type (str, optional): mixture used as input (default: mix_clean)
+       sample_rate (int, optional): must match the shards (default: 8000)
+       chunk_size (int, optional): split audio size (default: 32000(4 s))
+       least_size (int, optional): Minimum split size (default: 16000(2 s))
+       shuffle (bool, optional): shuffle the shard order every epoch and the
+                                 chunks within a buffer (default: True)
+       buffer_size (int, optional): chunks of the shuffle buffer (default: 1000)
+    '''
+
+    def __init__(self, shard_dir, num_spks=2, mix_type='mix_clean', sample_rate=8000,
+                 chunk_size=32000, least_size=16000, shuffle=True, buffer_size=1000):
+        super(ShardDataset, self).__init__()
+        self.num_spks = num_spks
+        self.mix_type = mix_type
+        self.sample_rate = sample_rate
+        self.chunk_size = chunk_size
+        self.least_size = least_size
+        self.shuffle = shuffle
+        self.buffer_size = buffer_size
+        self.shards = []
+        self.num_chunks = 0
+        self.epoch = 0
+        # shard, mixture ID and length of every mixture
+        with open(os.path.join(shard_dir, 'index.tsv'), 'r') as f:
+            f.readline()
+            for line in f:
+                shard, _, length = line.strip().split('\t')
+                path = os.path.join(shard_dir, shard)
+                if not self.shards or self.shards[-1] != path:
+                    self.shards.append(path)
+                self.num_chunks += len(chunk_spans(int(length), chunk_size, least_size))
+
+    def __len__(self):
+        '''
+           number of chunks of an epoch. The length of a DataLoader over it
+           is approximate: every worker batches its own shards, so up to
+           num_workers - 1 more partial batches come out than it reports
+        '''
+        return self.num_chunks
+
+    def worker_shards(self):
+        '''
+           shards read by this DataLoader worker
+        '''
+        order = list(range(len(self.shards)))
+        info = get_worker_info()
+        worker_id, num_workers = (0, 1) if info is None else (info.id, info.num_workers)
+        if self.shuffle:
+            # same permutation in every worker of an epoch, new every epoch
+            # (workers are seeded base_seed + id, epoch counts in-process epochs)
+            generator = torch.Generator()
+            generator.manual_seed(torch.initial_seed() - worker_id + self.epoch)
+            order = torch.randperm(len(self.shards), generator=generator).tolist()
+        return [self.shards[i] for i in order[worker_id::num_workers]]
+
+    def read_wav(self, data):
+        src, sr = sf.read(io.BytesIO(data), dtype='float32')
+        if sr != self.sample_rate:
+            raise ValueError('Shard audio is at {:d} Hz, not {:d} Hz'.format(
+                sr, self.sample_rate))
+        return torch.from_numpy(src)
+
+    def chunks(self):
+        for shard in self.worker_shards():
+            for _, group in read_shard(shard):
+                mix = self.read_wav(group[self.mix_type])
+                refs = [self.read_wav(group['s{:d}'.format(i+1)]) for i in range(self.num_spks)]
+                for start, size in chunk_spans(mix.shape[0], self.chunk_size, self.least_size):
+                    yield (read_chunk(mix, start, size, self.chunk_size),
+                           [read_chunk(ref, start, size, self.chunk_size) for ref in refs])
+
+    def __iter__(self):
+        self.epoch += 1
+        if not self.shuffle or self.buffer_size <= 1:
+            for egs in self.chunks():
+                yield egs
+            return
+        buffer = []
+        for egs in self.chunks():
+            buffer.append(egs)
+            if len(buffer) >= self.buffer_size:
+                i = torch.randint(len(buffer), (1,)).item()
+                buffer[i], buffer[-1] = buffer[-1], buffer[i]
+                yield buffer.pop()
+        while buffer:
+            i = torch.randint(len(buffer), (1,)).item()
+            buffer[i], buffer[-1] = buffer[-1], buffer[i]
+            yield buffer.pop()
+
+
+if __name__ == "__main__":
+    dataset = ShardDataset("/home/likai/data1/Libri2Mix/wav8k/min/train-100/shards")
+    for mix, refs in dataset:
+        print(mix.shape, [ref.shape for ref in refs])
+        break
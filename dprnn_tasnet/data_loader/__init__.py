@@ -1,2 +1,3 @@
 from .AudioData import *
-from .Dataset import *
\ No newline at end of file
+from .Dataset import *
+from .ChunkStore import *
\ No newline at end of file
@@ -1,31 +1,68 @@
 import os
+import time
 import torch
+import torch.nn.functional as F
 from data_loader.AudioReader import AudioReader, write_wav
+from data_loader.Dataset import TokenBudgetBatchSampler
+from utils.pipeline import Prefetcher, AsyncWriter, queue_report
 import argparse
 from torch.nn.parallel import data_parallel
 from model.model_rnn import Dual_RNN_model
 from logger.set_logger import setup_logger
 import logging
 from config.option import parse
+from utils.util import chunked_inference, autocast
+from export import load_checkpoint, read_checkpoint
 import tqdm
 
 
 class Separation():
-    def __init__(self, mix_path, yaml_path, model, gpuid, nogpu):
+    def __init__(self, mix_path, yaml_path, model, gpuid, nogpu, chunk_size=0, chunk_overlap=8000,
+                 batch_samples=0, num_io_workers=0, quantize=None, onnx_model=None, num_threads=0,
+                 precision='fp32', max_spread=1.1):
         super(Separation, self).__init__()
+        # fp32, or bf16 autocast of the forward pass
+        self.precision = precision
+        if precision != 'fp32' and (quantize or onnx_model is not None):
+            raise ValueError('precision {} only applies to the fp32 PyTorch model'.format(precision))
+        # wavs are read and written in background threads when num_io_workers > 0
+        self.num_io_workers = num_io_workers
+        self.prefetcher = None
+        self.writer = AsyncWriter(num_io_workers, depth=8*num_io_workers) if num_io_workers else None
+        # utterances are separated in padded batches when batch_samples > 0
+        self.batch_samples = batch_samples
+        # longest / shortest utterance of a batch, caps the padding
+        self.max_spread = max_spread
+        if chunk_size and batch_samples:
+            raise ValueError('chunk_size and batch_samples cannot be combined')
+        # long utterances are separated window by window when chunk_size > 0
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
         self.mix = AudioReader(mix_path, sample_rate=8000)
         opt = parse(yaml_path)
-        net = Dual_RNN_model(**opt['Dual_Path_RNN'])
-        dicts = torch.load(model, map_location='cpu')
-        net.load_state_dict(dicts["model_state_dict"])
         setup_logger(opt['logger']['name'], opt['logger']['path'],
                      screen=opt['logger']['screen'], tofile=opt['logger']['tofile'])
         self.logger = logging.getLogger(opt['logger']['name'])
         self.logger.info(self.mix)
+        if onnx_model is not None:
+            # onnxruntime is only needed for this backend
+            from onnx_backend import OnnxSeparator
+            self.logger.info('Load ONNX model from {}, running on the cpu'.format(onnx_model))
+            self.net = OnnxSeparator(onnx_model, num_threads)
+            self.device = torch.device('cpu')
+            self.gpuid = []
+            return
+        net = Dual_RNN_model(**opt['Dual_Path_RNN'])
+        # a checkpoint saved by export.py -quantize is loaded quantized
+        dicts = read_checkpoint(model)
+        net = load_checkpoint(net, dicts, quantize)
         self.logger.info(
             'Load checkpoint from {}, epoch {: d}'.format(model, dicts["epoch"]))
 
-        if nogpu:
+        quantized = quantize or dicts.get('quantize')
+        if quantized:
+            self.logger.info('{} dynamic quantization, running on the cpu'.format(quantized))
+        if nogpu or quantized:
             self.net = net.cpu()
             self.device = torch.device('cpu')
             self.gpuid = []
@@ -35,37 +72,98 @@ class Separation():
                 gpuid[0]) if len(gpuid) > 0 else 'cpu')
             self.gpuid = tuple(gpuid)
 
+    def save(self, file_path, key, spks):
+        for index, s in enumerate(spks, 1):
+            # bf16 outputs are normalized and written in fp32
+            s = s.float()
+            s = s - torch.mean(s)
+            s = s/torch.max(torch.abs(s))
+            # norm
+            # s = s*norm/torch.max(torch.abs(s))
+            s = s.unsqueeze(0)
+            os.makedirs(file_path+'/spk'+str(index), exist_ok=True)
+            filename = file_path+'/spk'+str(index)+'/'+key
+            if self.writer is not None:
+                self.writer.submit(write_wav, filename, s, 8000)
+            else:
+                write_wav(filename, s, 8000)
+
+    def reader(self, items, load):
+        '''
+           (item, load(item)) for every item, prefetched by the reader
+           threads when num_io_workers > 0
+        '''
+        if self.num_io_workers:
+            self.prefetcher = Prefetcher(items, load, self.num_io_workers,
+                                         depth=4*self.num_io_workers)
+            return self.prefetcher
+        return ((item, load(item)) for item in items)
+
+    def report(self, seconds, start):
+        if self.writer is not None:
+            self.writer.close()
+            self.logger.info(queue_report(self.prefetcher, self.writer))
+        elapsed = time.time() - start
+        self.logger.info(
+            "Compute over {:d} utterances".format(len(self.mix)))
+        self.logger.info("{:.1f} s of audio in {:.1f} s, {:.2f} utterances/s, real-time factor {:.4f}".format(
+            seconds, elapsed, len(self.mix) / elapsed, elapsed / seconds))
+
+    def inference_batched(self, file_path):
+        '''
+           Sort the utterances by length and separate them in zero padded
+           batches of at most batch_samples samples (batch size x longest
+           utterance), every output is trimmed back to its utterance.
+           Utterances longer than batch_samples are separated alone and the
+           longest utterance of a batch is at most max_spread times its
+           shortest
+        '''
+        lengths = self.mix.lengths()
+        if max(lengths) > self.batch_samples:
+            self.logger.info("Utterances longer than batch_samples are separated alone")
+        sampler = TokenBudgetBatchSampler(
+            lengths, self.batch_samples, shuffle=False, long_alone=True, max_spread=self.max_spread)
+        start, seconds = time.time(), 0
+        with torch.no_grad(), autocast(self.device, self.precision):
+            for batch, egs in tqdm.tqdm(self.reader(
+                    sampler, lambda batch: [self.mix[index] for index in batch])):
+                T = max(e.shape[0] for e in egs)
+                egs = torch.stack([F.pad(e, (0, T - e.shape[0])) for e in egs]).to(self.device)
+                ests = [s.detach().cpu() for s in self.net(egs)]
+                for b, index in enumerate(batch):
+                    self.save(file_path, self.mix.keys[index],
+                              [s[b, :lengths[index]] for s in ests])
+                    seconds += lengths[index] / 8000
+        self.report(seconds, start)
+
     def inference(self, file_path):
-        with torch.no_grad():
-            for key, egs in tqdm.tqdm(self.mix):
+        if self.batch_samples:
+            return self.inference_batched(file_path)
+        start, seconds = time.time(), 0
+        with torch.no_grad(), autocast(self.device, self.precision):
+            for key, egs in tqdm.tqdm(self.reader(self.mix.keys, self.mix.__getitem__)):
                 # self.logger.info("Compute on utterance {}...".format(key))
                 egs = egs.to(self.device)
                 norm = torch.norm(egs, float('inf'))
                 if len(self.gpuid) != 0:
                     if egs.dim() == 1:
                         egs = torch.unsqueeze(egs, 0)
-                    ests = self.net(egs)
-                    spks = [torch.squeeze(s.detach().cpu()) for s in ests]
+                    if self.chunk_size:
+                        spks = chunked_inference(self.net, egs, self.chunk_size, self.chunk_overlap)
+                    else:
+                        ests = self.net(egs)
+                        spks = [torch.squeeze(s.detach().cpu()) for s in ests]
                 else:
                     if egs.dim() == 1:
                         egs = torch.unsqueeze(egs, 0)
-                    ests = self.net(egs)
-                    spks = [torch.squeeze(s.detach()) for s in ests]
-                index = 0
-                for s in spks:
-                    s = s[:egs.shape[1]]
-                    s = s - torch.mean(s)
-                    s = s/torch.max(torch.abs(s))
-                    # norm
-                    # s = s*norm/torch.max(torch.abs(s))
-                    s = s.unsqueeze(0)
-                    index += 1
-                    os.makedirs(file_path+'/spk'+str(index), exist_ok=True)
-                    filename = file_path+'/spk'+str(index)+'/'+key
-                    write_wav(filename, s, 8000)
-                # break
-            self.logger.info(
-                "Compute over {:d} utterances".format(len(self.mix)))
+                    if self.chunk_size:
+                        spks = chunked_inference(self.net, egs, self.chunk_size, self.chunk_overlap)
+                    else:
+                        ests = self.net(egs)
+                        spks = [torch.squeeze(s.detach()) for s in ests]
+                self.save(file_path, key, [s[:egs.shape[1]] for s in spks])
+                seconds += egs.shape[1] / 8000
+        self.report(seconds, start)
 
 
 def main():
@@ -80,12 +178,38 @@ def main():
         '-gpuid', type=str, default='0', help='Enter GPU id number')
     parser.add_argument(
         '-nogpu', type=bool, default=False, help='Use without gpu')
+    parser.add_argument(
+        '-batch_samples', type=int, default=0,
+        help='Sort utterances by length and separate them in padded batches of at most this many samples, 0 for one by one')
+    parser.add_argument(
+        '-max_spread', type=float, default=1.1,
+        help='With -batch_samples, longest / shortest utterance of a batch, caps the zero padding')
+    parser.add_argument(
+        '-num_io_workers', type=int, default=0,
+        help='Threads prefetching the inputs and writing the outputs, 0 reads and writes in the main thread')
+    parser.add_argument(
+        '-quantize', type=str, default=None, choices=['int8'],
+        help='Quantize the LSTMs and Linear layers dynamically (cpu only)')
+    parser.add_argument(
+        '-precision', type=str, default='fp32', choices=['fp32', 'bf16'],
+        help='bf16 runs the model under bfloat16 autocast')
+    parser.add_argument(
+        '-onnx_model', type=str, default=None,
+        help='Run this model exported by export.py -onnx in onnxruntime instead of -model')
+    parser.add_argument(
+        '-num_threads', type=int, default=0, help='onnxruntime threads, 0 for one per core')
     parser.add_argument(
         '-save_path', type=str, default='./result/dual-rnn/', help='save result path')
+    parser.add_argument(
+        '-chunk_size', type=int, default=0, help='Separate in windows of this many samples, 0 for whole utterances')
+    parser.add_argument(
+        '-chunk_overlap', type=int, default=8000, help='Samples shared by neighboring windows')
     args = parser.parse_args()
     gpuid = [int(i) for i in args.gpuid.split(',')]
     separation = Separation(args.mix_scp, args.yaml,
-                            args.model, gpuid, args.nogpu)
+                            args.model, gpuid, args.nogpu,
+                            args.chunk_size, args.chunk_overlap, args.batch_samples, args.num_io_workers, args.quantize,
+                            args.onnx_model, args.num_threads, args.precision, args.max_spread)
     separation.inference(args.save_path)
 
 
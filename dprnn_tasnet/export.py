@@ -0,0 +1,284 @@
+import io
+import os
+import time
+import inspect
+import argparse
+import itertools
+import torch
+from torch import nn
+from data_loader.AudioReader import AudioReader
+from model.loss import sisnr
+from model import model, model_rnn
+from model.model import Conv_TasNet
+from model.model_rnn import Dual_RNN_model
+from config.option import parse
+
+
+def quantize_model(net, quantize='int8'):
+    '''
+       Dynamic quantization of the RNNs and Linear layers (the intra/inter
+       LSTMs and projections of the Dual-Path blocks), weights are stored in
+       int8 and activations are quantized on the fly, cpu only
+       input:
+             net: fp32 model
+             quantize: 'int8'
+       output:
+             net: quantized model in eval mode
+    '''
+    if quantize != 'int8':
+        raise ValueError('Unsupported quantization {}'.format(quantize))
+    return torch.quantization.quantize_dynamic(
+        net.eval(), {nn.LSTM, nn.GRU, nn.Linear}, dtype=torch.qint8)
+
+
+def load_checkpoint(net, dicts, quantize=None):
+    '''
+       Load a checkpoint into a freshly built model
+       input:
+             net: fp32 model built from the yml
+             dicts: torch.load(checkpoint), fp32 or quantized by save_quantized
+             quantize: quantize a fp32 checkpoint after loading it ('int8')
+       output:
+             net: model in eval mode, quantized if the checkpoint or quantize says so
+    '''
+    if dicts.get('quantize'):
+        # the quantized modules have to exist before their weights are loaded
+        net = quantize_model(net, dicts['quantize'])
+    net.load_state_dict(dicts["model_state_dict"])
+    if quantize and not dicts.get('quantize'):
+        net = quantize_model(net, quantize)
+    return net.eval()
+
+
+def read_checkpoint(path):
+    '''
+       torch.load on the cpu, quantized weights are packed objects that
+       torch >= 2.6 only unpickles with weights_only=False
+    '''
+    try:
+        return torch.load(path, map_location='cpu', weights_only=False)
+    except TypeError:
+        # torch < 1.13 has no weights_only
+        return torch.load(path, map_location='cpu')
+
+
+def save_quantized(net, path, quantize='int8', epoch=0):
+    '''
+       Save a quantized model as a checkpoint that load_checkpoint reads back
+    '''
+    torch.save({'epoch': epoch, 'quantize': quantize,
+                'model_state_dict': net.state_dict()}, path)
+
+
+def state_size(net):
+    '''
+       Size of the serialized weights, MB
+    '''
+    buffer = io.BytesIO()
+    torch.save(net.state_dict(), buffer)
+    return buffer.tell() / 2**20
+
+
+def load_model(yaml_path, model_path=None, quantize=None):
+    '''
+       Build the model of a training yml and load its checkpoint
+       input:
+             yaml_path: config/Conv_Tasnet/train.yml or config/Dual_RNN/train_rnn.yml
+             model_path: checkpoint (best.pt / last.pt), random weights if None
+             quantize: quantize the model ('int8')
+       output:
+             net: Conv_TasNet or Dual_RNN_model in eval mode on the cpu
+    '''
+    opt = parse(yaml_path)
+    if 'Dual_Path_RNN' in opt:
+        net = Dual_RNN_model(**opt['Dual_Path_RNN'])
+    else:
+        net = Conv_TasNet(**opt['Conv_Tasnet'])
+    if model_path is not None:
+        return load_checkpoint(net, read_checkpoint(model_path), quantize)
+    if quantize:
+        net = quantize_model(net, quantize)
+    return net.eval()
+
+
+def evaluate(net, mix_scp, ref_scps):
+    '''
+       Mean SI-SNR improvement over the mixture on a test set, best
+       speaker permutation per utterance
+       input:
+             net: model on the cpu
+             mix_scp: tt_mix.scp
+             ref_scps: [tt_s1.scp, tt_s2.scp]
+       output:
+             sisnri: mean SI-SNRi in dB
+             rtf: compute time / audio duration
+    '''
+    mix = AudioReader(mix_scp, sample_rate=8000)
+    refs = [AudioReader(scp, sample_rate=8000) for scp in ref_scps]
+    total, elapsed, seconds = 0, 0, 0
+    with torch.no_grad():
+        for key, egs in mix:
+            egs = egs.unsqueeze(0)
+            start = time.time()
+            ests = net(egs)
+            elapsed += time.time() - start
+            seconds += egs.shape[1] / 8000
+            S = min(egs.shape[1], ests[0].shape[1])
+            srcs = [ref[key].unsqueeze(0)[:, :S] for ref in refs]
+            ests = [est[:, :S] for est in ests]
+            best = max(sum(sisnr(ests[s], srcs[t]) for s, t in enumerate(p)).item()
+                       for p in itertools.permutations(range(len(srcs))))
+            base = sum(sisnr(egs[:, :S], src) for src in srcs).item()
+            total += (best - base) / len(srcs)
+    return total / len(mix), elapsed / seconds
+
+
+def script_model(net):
+    '''
+       TorchScript version of a model, frozen for inference
+       input:
+             net: Conv_TasNet or Dual_RNN_model in eval mode
+       output:
+             scripted: ScriptModule, scripted(x [B, T]) -> spks x [B, T]
+    '''
+    scripted = torch.jit.script(net.eval())
+    # torch.jit.freeze is only in torch >= 1.7
+    return torch.jit.freeze(scripted) if hasattr(torch.jit, 'freeze') else scripted
+
+
+def export_onnx(net, path, opset_version=17):
+    '''
+       Export a model to ONNX, batch and length axes are dynamic
+       input:
+             net: fp32 Conv_TasNet or Dual_RNN_model
+             path: .onnx file
+       output:
+             None, the graph has input 'mix' [B, T] and outputs 'spk1', 'spk2', ...
+    '''
+    names = ['spk{:d}'.format(i+1) for i in range(net.num_spks)]
+    axes = {name: {0: 'batch', 1: 'samples'} for name in ['mix'] + names}
+    kwargs = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        # the TorchScript exporter, the dynamo one needs onnxscript
+        kwargs['dynamo'] = False
+    torch.onnx.export(net.eval(), (torch.randn(1, 16000),), path, input_names=['mix'],
+                      output_names=names, dynamic_axes=axes, opset_version=opset_version,
+                      **kwargs)
+
+
+def onnx_min_snr(net):
+    '''
+       Default lowest SNR in dB of the ONNX outputs against PyTorch.
+       Without ln (GroupNorm) or gln both models match to about 125 dB.
+       onnxruntime sums the utterance-wide statistics of those norms in
+       another order: Conv-TasNet then stays above 95 dB, while the RNNs of
+       the Dual-Path RNN carry the rounding on (53 to 90 dB)
+    '''
+    utterance_norms = (model.GroupNorm, model.GlobalLayerNorm,
+                       model_rnn.GroupNorm, model_rnn.GlobalLayerNorm)
+    if not any(isinstance(m, utterance_norms) for m in net.modules()):
+        return 100
+    return 40 if isinstance(net, Dual_RNN_model) else 80
+
+
+def check_onnx(net, path, shapes=((1, 16000), (2, 12345), (1, 40000)), min_snr=None):
+    '''
+       Compare an exported ONNX model with the PyTorch one in onnxruntime
+       input:
+             net: the exported model
+             path: .onnx file
+             shapes: [B, T] of the random test inputs
+             min_snr: lowest SNR in dB of the ONNX outputs against the
+                      PyTorch ones, onnx_min_snr(net) if None. A wrong
+                      graph is below 20 dB
+       output:
+             worst SNR in dB, RuntimeError below min_snr
+    '''
+    if min_snr is None:
+        min_snr = onnx_min_snr(net)
+    from onnx_backend import OnnxSeparator
+    session = OnnxSeparator(path)
+    worst = float('inf')
+    with torch.no_grad():
+        for shape in shapes:
+            x = torch.randn(*shape)
+            for ref, out in zip(net(x), session.separate(x.numpy())):
+                if tuple(ref.shape) != out.shape:
+                    raise RuntimeError('ONNX output shape {} differs from {} for input {}'.format(
+                        out.shape, tuple(ref.shape), shape))
+                noise = torch.sum((ref - torch.from_numpy(out))**2).clamp(min=1e-20)
+                snr = 10 * torch.log10(torch.sum(ref**2).clamp(min=1e-20) / noise)
+                worst = min(worst, snr.item())
+    if worst < min_snr:
+        raise RuntimeError('ONNX model differs from PyTorch, SNR {:.1f} dB < {:.1f} dB'.format(
+            worst, min_snr))
+    return worst
+
+
+def max_difference(net, exported, length=16000):
+    '''
+       Largest absolute difference between two models on a random input
+    '''
+    x = torch.randn(1, length)
+    with torch.no_grad():
+        return max((a - b).abs().max().item() for a, b in zip(net(x), exported(x)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-yaml', type=str, default='./config/Dual_RNN/train_rnn.yml', help='Path to yaml file.')
+    parser.add_argument(
+        '-model', type=str, default='./checkpoint/Dual_Path_RNN/best.pt', help="Path to model file.")
+    parser.add_argument(
+        '-out', type=str, default=None,
+        help='Path of the TorchScript file, of the quantized checkpoint with -quantize or of the '
+             'ONNX file with -onnx. Next to -model by default: best.ts.pt, best.int8.pt, best.onnx.')
+    parser.add_argument(
+        '-quantize', type=str, default=None, choices=['int8'],
+        help='Save a dynamically quantized checkpoint instead of TorchScript.')
+    parser.add_argument(
+        '-onnx', action='store_true', help='Export to ONNX (-out x.onnx) instead of TorchScript.')
+    parser.add_argument(
+        '-min_snr', type=float, default=None,
+        help='With -onnx, lowest SNR in dB of the onnxruntime outputs against PyTorch, '
+             'by default 100, or with norm ln or gln 80 for Conv-TasNet and 40 for the Dual-Path RNN.')
+    parser.add_argument(
+        '-mix_scp', type=str, default=None, help='With -quantize, compare SI-SNRi on this scp.')
+    parser.add_argument(
+        '-ref_scp', type=str, nargs='+', default=['./tt_s1.scp', './tt_s2.scp'],
+        help='Reference scp files of -mix_scp, one per speaker.')
+    args = parser.parse_args()
+    if args.out is None:
+        suffix = '.onnx' if args.onnx else '.{}.pt'.format(args.quantize) if args.quantize else '.ts.pt'
+        args.out = os.path.splitext(args.model)[0] + suffix
+    net = load_model(args.yaml, args.model)
+    if args.onnx:
+        export_onnx(net, args.out)
+        print('Saved {}, SNR of onnxruntime against PyTorch {:.1f} dB'.format(
+            args.out, check_onnx(net, args.out, min_snr=args.min_snr)))
+        return
+    if args.quantize:
+        quantized = quantize_model(load_model(args.yaml, args.model), args.quantize)
+        epoch = read_checkpoint(args.model).get('epoch', 0)
+        save_quantized(quantized, args.out, args.quantize, epoch)
+        loaded = load_model(args.yaml, args.out)
+        print('Saved {}, weights {:.1f} MB -> {:.1f} MB, max difference to fp32 {:.3e}'.format(
+            args.out, state_size(net), state_size(loaded), max_difference(net, loaded)))
+        if args.mix_scp is not None:
+            sisnri, rtf = evaluate(net, args.mix_scp, args.ref_scp)
+            q_sisnri, q_rtf = evaluate(loaded, args.mix_scp, args.ref_scp)
+            print('fp32 SI-SNRi {:.2f} dB, real-time factor {:.4f}'.format(sisnri, rtf))
+            print('{} SI-SNRi {:.2f} dB, real-time factor {:.4f}'.format(args.quantize, q_sisnri, q_rtf))
+            print('delta {:+.2f} dB, {:.2f}x faster'.format(q_sisnri - sisnri, rtf / q_rtf))
+        return
+    scripted = script_model(net)
+    scripted.save(args.out)
+    # check the saved file, not only the in-memory module
+    loaded = torch.jit.load(args.out)
+    print('Saved {}, max difference to the eager model {:.3e}'.format(
+        args.out, max_difference(net, loaded)))
+
+
+if __name__ == "__main__":
+    main()
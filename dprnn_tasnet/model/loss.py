@@ -1,12 +1,14 @@
 import torch
 from itertools import permutations
 
-def sisnr(x, s, eps=1e-8):
+def sisnr(x, s, eps=1e-8, mask=None):
     """
     calculate training loss
     input:
           x: separated signal, N x S tensor
           s: reference signal, N x S tensor
+          mask: optional N x S tensor, 1 for valid samples and 0 for
+                padding, padded samples are left out of the si-snr
     Return:
           sisnr: N tensor
     """
@@ -18,23 +20,41 @@ def sisnr(x, s, eps=1e-8):
         raise RuntimeError(
             "Dimention mismatch when calculate si-snr, {} vs {}".format(
                 x.shape, s.shape))
-    x_zm = x - torch.mean(x, dim=-1, keepdim=True)
-    s_zm = s - torch.mean(s, dim=-1, keepdim=True)
+    # fp32 even for bf16 autocast outputs
+    if x.dtype in (torch.bfloat16, torch.float16) or s.dtype in (torch.bfloat16, torch.float16):
+        x, s = x.float(), s.float()
+    if mask is not None:
+        # a bf16 mask would round the count of valid samples
+        mask = mask.to(x.dtype)
+        num = torch.sum(mask, dim=-1, keepdim=True)
+        x_zm = (x - torch.sum(x * mask, dim=-1, keepdim=True) / num) * mask
+        s_zm = (s - torch.sum(s * mask, dim=-1, keepdim=True) / num) * mask
+    else:
+        x_zm = x - torch.mean(x, dim=-1, keepdim=True)
+        s_zm = s - torch.mean(s, dim=-1, keepdim=True)
     t = torch.sum(
         x_zm * s_zm, dim=-1,
         keepdim=True) * s_zm / (l2norm(s_zm, keepdim=True)**2 + eps)
     return 20 * torch.log10(eps + l2norm(t) / (l2norm(x_zm - t) + eps))
 
 
-def Loss(ests, egs):
+def Loss(ests, egs, lengths=None):
     # spks x n x S
+    # lengths: optional n tensor of valid samples per utterance (dynamic batching)
     refs = egs
     num_spks = len(refs)
+    mask = None
+    if lengths is not None:
+        # the decoder may return a few samples less than the padded input
+        S = min(ests[0].shape[-1], refs[0].shape[-1])
+        ests = [e[..., :S] for e in ests]
+        refs = [r[..., :S] for r in refs]
+        mask = (torch.arange(S, device=lengths.device)[None, :] < lengths[:, None]).float()
 
     def sisnr_loss(permute):
         # for one permute
         return sum(
-            [sisnr(ests[s], refs[t])
+            [sisnr(ests[s], refs[t], mask=mask)
              for s, t in enumerate(permute)]) / len(permute)
              # average the value
 
@@ -5,6 +5,17 @@ import sys
 sys.path.append('../')
 from utils.util import check_parameters
 
+
+def fp32(x):
+    # type: (Tensor) -> Tensor
+    '''
+       bf16/fp16 inputs of the norms back to fp32, other dtypes unchanged
+    '''
+    if x.dtype == torch.bfloat16 or x.dtype == torch.float16:
+        return x.float()
+    return x
+
+
 class GlobalLayerNorm(nn.Module):
     '''
        Calculate Global Layer Normalization
@@ -35,8 +46,9 @@ class GlobalLayerNorm(nn.Module):
         # cln: mean,var N x 1 x L
         # gln: mean,var N x 1 x 1
         if x.dim() != 3:
-            raise RuntimeError("{} accept 3D tensor as input".format(
-                self.__name__))
+            raise RuntimeError("GlobalLayerNorm accept 3D tensor as input")
+        # statistics in fp32 under bf16 autocast
+        x = fp32(x)
 
         mean = torch.mean(x, (1, 2), keepdim=True)
         var = torch.mean((x-mean)**2, (1, 2), keepdim=True)
@@ -61,24 +73,45 @@ class CumulativeLayerNorm(nn.LayerNorm):
 
     def forward(self, x):
         # x: N x C x L
-        # N x L x C
-        x = torch.transpose(x, 1, 2)
+        # N x L x C, fp32 under bf16 autocast
+        x = torch.transpose(fp32(x), 1, 2)
         # N x L x C == only channel norm
-        x = super().forward(x)
+        x = F.layer_norm(x, self.normalized_shape, self.weight, self.bias, self.eps)
         # N x C x L
         x = torch.transpose(x, 1, 2)
         return x
 
 
+class GroupNorm(nn.GroupNorm):
+    '''
+       nn.GroupNorm with fp32 statistics under bf16 autocast
+    '''
+
+    def forward(self, x):
+        return F.group_norm(fp32(x), self.num_groups, self.weight, self.bias, self.eps)
+
+
+class BatchNorm1d(nn.BatchNorm1d):
+    '''
+       nn.BatchNorm1d with fp32 statistics under bf16 autocast
+    '''
+
+    def forward(self, x):
+        if self.training and self.num_batches_tracked is not None:
+            self.num_batches_tracked.add_(1)
+        return F.batch_norm(fp32(x), self.running_mean, self.running_var, self.weight,
+                            self.bias, self.training, self.momentum, self.eps)
+
+
 def select_norm(norm, dim):
     if norm == 'gln':
         return GlobalLayerNorm(dim, elementwise_affine=True)
     if norm == 'cln':
         return CumulativeLayerNorm(dim, elementwise_affine=True)
     if norm == 'ln':
-        return nn.GroupNorm(1, dim)
+        return GroupNorm(1, dim)
     else:
-        return nn.BatchNorm1d(dim)
+        return BatchNorm1d(dim)
 
 
 class Conv1D(nn.Module):
@@ -96,8 +129,10 @@ class Conv1D(nn.Module):
         self.norm1 = select_norm(norm, out_channels)
         self.pad = (dilation*(kernel_size-1)
                     )//2 if not causal else dilation*(kernel_size-1)
+        # causal: only left padding, applied in forward
         self.dwconv = nn.Conv1d(out_channels, out_channels, kernel_size=kernel_size,
-                                groups=out_channels, padding=self.pad, dilation=dilation)
+                                groups=out_channels, padding=0 if causal else self.pad,
+                                dilation=dilation)
         self.PReLu2 = nn.PReLU()
         self.norm2 = select_norm(norm,out_channels)
         self.end_conv1x1 = nn.Conv1d(out_channels, in_channels, 1)
@@ -114,12 +149,12 @@ class Conv1D(nn.Module):
         x_conv = self.PReLu1(x_conv)
         x_conv = self.norm1(x_conv)
         # B x C_o x T_o
+        if self.causal:
+            x_conv = F.pad(x_conv, (self.pad, 0))
         x_conv = self.dwconv(x_conv)
         x_conv = self.PReLu2(x_conv)
         x_conv = self.norm2(x_conv)
         # B x C_o x T_o -> B x C x T
-        if self.causal:
-            x_conv = x_conv[:, :, :-self.pad]
         x_conv = self.end_conv1x1(x_conv)
         return x+x_conv
 
@@ -168,15 +203,11 @@ class Decoder(nn.ConvTranspose1d):
         x: N x L or N x C x L
         """
         if x.dim() not in [2, 3]:
-            raise RuntimeError("{} accept 2/3D tensor as input".format(
-                self.__name__))
-        x = super().forward(x if x.dim() == 3 else torch.unsqueeze(x, 1))
-        
-        if torch.squeeze(x).dim() == 1:
-            x = torch.squeeze(x,dim=1)
-        else:
-            x = torch.squeeze(x)
-            
+            raise RuntimeError("Decoder accept 2/3D tensor as input")
+        x = F.conv_transpose1d(x if x.dim() == 3 else torch.unsqueeze(x, 1), self.weight, self.bias,
+                               self.stride, self.padding, self.output_padding, self.groups, self.dilation)
+        # N x 1 x L -> N x L
+        x = torch.squeeze(x, dim=1)
         return x
 
 
@@ -295,6 +326,108 @@ class Conv_TasNet(nn.Module):
         return audio
 
 
+class StreamingConvTasNet(nn.Module):
+    '''
+       Streaming inference of a causal Conv_TasNet
+       Audio is fed in small hops (e.g. 160 samples, 20 ms at 8 kHz), every
+       call only computes the new frames: the encoder keeps the last L - L/2
+       input samples, every dilated depthwise conv keeps its last
+       dilation*(P-1) input frames and the decoder keeps the L - L/2 samples
+       still waiting for the overlap-add of the next frame. The concatenated
+       outputs of forward and flush equal Conv_TasNet.forward on the whole
+       input. Only frame-wise norms ('cln', or BatchNorm in eval mode) can
+       stream, 'gln' and 'ln' look at the whole utterance.
+       net: Conv_TasNet built with causal=True
+    '''
+
+    def __init__(self, net):
+        super(StreamingConvTasNet, self).__init__()
+        blocks = [block for repeat in net.separation.conv1d_list for block in repeat]
+        if not all(block.causal for block in blocks):
+            raise ValueError('StreamingConvTasNet needs a Conv_TasNet with causal=True')
+        for block in blocks:
+            for norm in (block.norm1, block.norm2):
+                if isinstance(norm, (GlobalLayerNorm, nn.GroupNorm)):
+                    raise ValueError('{} is not causal, use norm cln or bn to stream'.format(
+                        type(norm).__name__))
+        self.net = net
+        self.blocks = blocks
+        self.kernel_size = net.encoder.conv1d.kernel_size[0]
+        self.stride = net.encoder.conv1d.stride[0]
+        self.reset()
+
+    def reset(self):
+        '''
+           Forget the previous stream
+        '''
+        self.samples = None
+        self.history = None
+        self.overlap = None
+
+    def _init_state(self, x):
+        B = x.shape[0]
+        self.samples = x.new_zeros(B, 0)
+        self.history = [x.new_zeros(B, block.dwconv.in_channels, block.pad)
+                        for block in self.blocks]
+        self.overlap = [x.new_zeros(B, self.kernel_size - self.stride)
+                        for _ in range(self.net.num_spks)]
+
+    def _block(self, i, x):
+        # Conv1D.forward, with the left context taken from the history
+        block = self.blocks[i]
+        x_conv = block.norm1(block.PReLu1(block.conv1x1(x)))
+        x_conv = torch.cat([self.history[i], x_conv], dim=2)
+        self.history[i] = x_conv[:, :, x_conv.shape[2]-block.pad:]
+        x_conv = block.norm2(block.PReLu2(block.dwconv(x_conv)))
+        return x+block.end_conv1x1(x_conv)
+
+    def forward(self, x):
+        """
+          Input:
+              x: [B, hop], the next samples of the stream
+          Returns:
+              [B, T_out] per speaker, the samples finalized by this hop
+              (T_out is a multiple of L/2, it is 0 until the first frame)
+        """
+        if self.samples is None:
+            self._init_state(x)
+        self.samples = torch.cat([self.samples, x], dim=1)
+        num_frames = (self.samples.shape[1]-self.kernel_size)//self.stride+1
+        if num_frames <= 0:
+            return [x.new_zeros(x.shape[0], 0) for _ in range(self.net.num_spks)]
+        used = (num_frames-1)*self.stride+self.kernel_size
+        # B x C x num_frames
+        x_encoder = self.net.encoder(self.samples[:, :used])
+        self.samples = self.samples[:, num_frames*self.stride:]
+        separation = self.net.separation
+        x = separation.conv1x1(separation.norm(x_encoder))
+        for i in range(len(self.blocks)):
+            x = self._block(i, x)
+        x = separation.end_conv1x1(separation.PReLu(x))
+        x_sep = separation.activation(torch.stack(
+            torch.chunk(x, self.net.num_spks, dim=1), dim=0))
+        decoder = self.net.decoder
+        audio = []
+        for i in range(self.net.num_spks):
+            # overlap-add without bias, the bias is added once per sample
+            y = F.conv_transpose1d(x_encoder*x_sep[i], decoder.weight,
+                                   stride=decoder.stride)[:, 0]
+            y[:, :self.overlap[i].shape[1]] += self.overlap[i]
+            self.overlap[i] = y[:, num_frames*self.stride:]
+            y = y[:, :num_frames*self.stride]
+            audio.append(y+decoder.bias if decoder.bias is not None else y)
+        return audio
+
+    def flush(self):
+        '''
+           Last L - L/2 samples of the stream, then reset
+        '''
+        bias = self.net.decoder.bias
+        audio = [y+bias if bias is not None else y for y in self.overlap]
+        self.reset()
+        return audio
+
+
 if __name__ == "__main__":
     conv = Conv_TasNet()
     #encoder = Encoder(16, 512)
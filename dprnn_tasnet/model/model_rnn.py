@@ -10,6 +10,17 @@ import warnings
 
 warnings.filterwarnings('ignore')
 
+
+def fp32(x):
+    # type: (Tensor) -> Tensor
+    '''
+       bf16/fp16 inputs of the norms back to fp32, other dtypes unchanged
+    '''
+    if x.dtype == torch.bfloat16 or x.dtype == torch.float16:
+        return x.float()
+    return x
+
+
 class GlobalLayerNorm(nn.Module):
     '''
        Calculate Global Layer Normalization
@@ -43,6 +54,8 @@ class GlobalLayerNorm(nn.Module):
         # N x 1 x 1
         # cln: mean,var N x 1 x K x S
         # gln: mean,var N x 1 x 1
+        # statistics in fp32 under bf16 autocast
+        x = fp32(x)
         if x.dim() == 4:
             mean = torch.mean(x, (1, 2, 3), keepdim=True)
             var = torch.mean((x-mean)**2, (1, 2, 3), keepdim=True)
@@ -72,32 +85,54 @@ class CumulativeLayerNorm(nn.LayerNorm):
             dim, elementwise_affine=elementwise_affine, eps=1e-8)
 
     def forward(self, x):
-        # x: N x C x K x S or N x C x L
+        # x: N x C x K x S or N x C x L, fp32 under bf16 autocast
+        x = fp32(x)
         # N x K x S x C
         if x.dim() == 4:
            x = x.permute(0, 2, 3, 1).contiguous()
            # N x K x S x C == only channel norm
-           x = super().forward(x)
+           x = F.layer_norm(x, self.normalized_shape, self.weight, self.bias, self.eps)
            # N x C x K x S
            x = x.permute(0, 3, 1, 2).contiguous()
         if x.dim() == 3:
             x = torch.transpose(x, 1, 2)
             # N x L x C == only channel norm
-            x = super().forward(x)
+            x = F.layer_norm(x, self.normalized_shape, self.weight, self.bias, self.eps)
             # N x C x L
             x = torch.transpose(x, 1, 2)
         return x
 
 
+class GroupNorm(nn.GroupNorm):
+    '''
+       nn.GroupNorm with fp32 statistics under bf16 autocast
+    '''
+
+    def forward(self, x):
+        return F.group_norm(fp32(x), self.num_groups, self.weight, self.bias, self.eps)
+
+
+class BatchNorm1d(nn.BatchNorm1d):
+    '''
+       nn.BatchNorm1d with fp32 statistics under bf16 autocast
+    '''
+
+    def forward(self, x):
+        if self.training and self.num_batches_tracked is not None:
+            self.num_batches_tracked.add_(1)
+        return F.batch_norm(fp32(x), self.running_mean, self.running_var, self.weight,
+                            self.bias, self.training, self.momentum, self.eps)
+
+
 def select_norm(norm, dim, shape):
     if norm == 'gln':
         return GlobalLayerNorm(dim, shape, elementwise_affine=True)
     if norm == 'cln':
         return CumulativeLayerNorm(dim, elementwise_affine=True)
     if norm == 'ln':
-        return nn.GroupNorm(1, dim, eps=1e-8)
+        return GroupNorm(1, dim, eps=1e-8)
     else:
-        return nn.BatchNorm1d(dim)
+        return BatchNorm1d(dim)
 
 class Encoder(nn.Module):
     '''
@@ -143,14 +178,11 @@ class Decoder(nn.ConvTranspose1d):
         x: [B, N, L]
         """
         if x.dim() not in [2, 3]:
-            raise RuntimeError("{} accept 3/4D tensor as input".format(
-                self.__name__))
-        x = super().forward(x if x.dim() == 3 else torch.unsqueeze(x, 1))
-
-        if torch.squeeze(x).dim() == 1:
-            x = torch.squeeze(x, dim=1)
-        else:
-            x = torch.squeeze(x)
+            raise RuntimeError("Decoder accept 2/3D tensor as input")
+        x = F.conv_transpose1d(x if x.dim() == 3 else torch.unsqueeze(x, 1), self.weight, self.bias,
+                               self.stride, self.padding, self.output_padding, self.groups, self.dilation)
+        # [B, 1, L] -> [B, L]
+        x = torch.squeeze(x, dim=1)
         return x
 
 
@@ -285,8 +317,8 @@ class Dual_Path_RNN(nn.Module):
         # [B, N, K, S]
         x, gap = self._Segmentation(x, self.K)
         # [B, N*spks, K, S]
-        for i in range(self.num_layers):
-            x = self.dual_rnn[i](x)
+        for dual_rnn in self.dual_rnn:
+            x = dual_rnn(x)
         x = self.prelu(x)
         x = self.conv2d(x)
         # [B*spks, N, K, S]
@@ -307,6 +339,7 @@ class Dual_Path_RNN(nn.Module):
         return x
 
     def _padding(self, input, K):
+        # type: (Tensor, int) -> Tuple[Tensor, int]
         '''
            padding the audio times
            K: chunks of length
@@ -316,16 +349,13 @@ class Dual_Path_RNN(nn.Module):
         B, N, L = input.shape
         P = K // 2
         gap = K - (P + L % K) % K
-        if gap > 0:
-            pad = torch.Tensor(torch.zeros(B, N, gap)).type(input.type())
-            input = torch.cat([input, pad], dim=2)
-
-        _pad = torch.Tensor(torch.zeros(B, N, P)).type(input.type())
-        input = torch.cat([_pad, input, _pad], dim=2)
+        # P zeros in front, gap + P behind, in one copy
+        input = F.pad(input, (P, gap + P))
 
         return input, gap
 
     def _Segmentation(self, input, K):
+        # type: (Tensor, int) -> Tuple[Tensor, int]
         '''
            the segmentation stage splits
            K: chunks of length
@@ -336,15 +366,22 @@ class Dual_Path_RNN(nn.Module):
         B, N, L = input.shape
         P = K // 2
         input, gap = self._padding(input, K)
+        if K == 2 * P:
+            # chunk s is hops s and s + 1 of P samples of the padded input,
+            # one copy (unfold would be a view but does not export to ONNX
+            # with a dynamic length)
+            input = input.view(B, N, -1, P)
+            input = torch.cat([input[:, :, :-1], input[:, :, 1:]], dim=3)
+        else:
+            # odd K: chunks start at 0, P, K, K + P, ...
+            input1 = input[:, :, :-P].reshape(B, N, -1, K)
+            input2 = input[:, :, P:].reshape(B, N, -1, K)
+            input = torch.stack([input1, input2], dim=3).view(B, N, -1, K)
         # [B, N, K, S]
-        input1 = input[:, :, :-P].contiguous().view(B, N, -1, K)
-        input2 = input[:, :, P:].contiguous().view(B, N, -1, K)
-        input = torch.cat([input1, input2], dim=3).view(
-            B, N, -1, K).transpose(2, 3)
-
-        return input.contiguous(), gap
+        return input.transpose(2, 3), gap
 
     def _over_add(self, input, gap):
+        # type: (Tensor, int) -> Tensor
         '''
            Merge sequence
            input: [B, N, K, S]
@@ -354,11 +391,18 @@ class Dual_Path_RNN(nn.Module):
         B, N, K, S = input.shape
         P = K // 2
         # [B, N, S, K]
-        input = input.transpose(2, 3).contiguous().view(B, N, -1, K * 2)
-
-        input1 = input[:, :, :, :K].contiguous().view(B, N, -1)[:, :, P:]
-        input2 = input[:, :, :, K:].contiguous().view(B, N, -1)[:, :, :-P]
-        input = input1 + input2
+        input = input.transpose(2, 3)
+        if K == 2 * P:
+            # every hop of P samples but the padded first and last ones is the
+            # second half of a chunk plus the first half of the next one,
+            # summed into a single new tensor
+            input = input[:, :, 1:, :P] + input[:, :, :-1, P:]
+            input = input.reshape(B, N, -1)
+        else:
+            input = input.reshape(B, N, -1, K * 2)
+            input1 = input[:, :, :, :K].reshape(B, N, -1)[:, :, P:]
+            input2 = input[:, :, :, K:].reshape(B, N, -1)[:, :, :-P]
+            input = input1 + input2
         # [B, N, L]
         if gap > 0:
             input = input[:, :, :-gap]
@@ -0,0 +1,88 @@
+import os
+import time
+import argparse
+import numpy as np
+import soundfile as sf
+import onnxruntime as ort
+
+
+class OnnxSeparator(object):
+    '''
+       Separation model exported by export.py -onnx, run in onnxruntime
+       on the cpu, without PyTorch
+       input:
+             model_path: .onnx file
+             num_threads: threads of one operator, 0 lets onnxruntime use
+                          one per physical core
+    '''
+
+    def __init__(self, model_path, num_threads=0):
+        super(OnnxSeparator, self).__init__()
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            model_path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.num_spks = len(self.session.get_outputs())
+
+    def separate(self, mix):
+        '''
+           input: mix [B, T] numpy array
+           output: list of num_spks [B, T] numpy arrays
+        '''
+        return self.session.run(None, {self.input_name: np.ascontiguousarray(mix, dtype=np.float32)})
+
+    def __call__(self, egs):
+        '''
+           torch tensors in and out, so that the test scripts can use it in
+           place of the PyTorch model
+        '''
+        # only imported when called from the PyTorch test scripts
+        import torch
+        return [torch.from_numpy(s) for s in self.separate(egs.detach().cpu().numpy())]
+
+
+def read_scp(scp_path):
+    '''
+       (key, wav path) of every line of a scp file
+    '''
+    with open(scp_path, 'r') as f:
+        return [tuple(line.split()) for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-onnx_model', type=str, default='./checkpoint/Dual_Path_RNN/best.onnx', help='Path to the ONNX model.')
+    parser.add_argument(
+        '-mix_scp', type=str, default='./tt_mix.scp', help='Path to mix scp file.')
+    parser.add_argument(
+        '-num_threads', type=int, default=0, help='onnxruntime threads, 0 for one per core')
+    parser.add_argument(
+        '-save_path', type=str, default='./result/onnx/', help='save result path')
+    args = parser.parse_args()
+    start = time.time()
+    separator = OnnxSeparator(args.onnx_model, args.num_threads)
+    print('Session ready in {:.2f} s'.format(time.time() - start))
+    elapsed, seconds = 0, 0
+    scp = read_scp(args.mix_scp)
+    for key, path in scp:
+        mix, sr = sf.read(path, dtype='float32')
+        if sr != 8000:
+            raise RuntimeError('SampleRate mismatch: {:d} vs {:d}'.format(sr, 8000))
+        start = time.time()
+        spks = separator.separate(mix[None])
+        elapsed += time.time() - start
+        seconds += mix.shape[0] / 8000
+        for index, s in enumerate(spks, 1):
+            s = s[0, :mix.shape[0]]
+            s = s - np.mean(s)
+            s = s / np.max(np.abs(s))
+            os.makedirs(os.path.join(args.save_path, 'spk' + str(index)), exist_ok=True)
+            sf.write(os.path.join(args.save_path, 'spk' + str(index), key), s, 8000, subtype='FLOAT')
+    print('Compute over {:d} utterances, real-time factor {:.4f}'.format(len(scp), elapsed / seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,8 @@ sys.path.append('./')
 
 from torch.optim.lr_scheduler import ReduceLROnPlateau
 from torch.utils.data import DataLoader as Loader
-from data_loader.Dataset import Datasets
+from data_loader.Dataset import Datasets, TokenBudgetBatchSampler, pad_collate
+from data_loader.ShardDataset import ShardDataset
 from model import model_rnn
 from logger import set_logger
 import logging
@@ -13,30 +14,89 @@ import torch
 from trainer import trainer_Dual_RNN
 
 
+def make_loader(dataset, opt, shuffle):
+    dataloader_setting = opt['datasets']['dataloader_setting']
+    if isinstance(dataset, ShardDataset):
+        # streamed in shard order, shuffling is done by the dataset
+        if dataloader_setting.get('max_tokens'):
+            raise ValueError('max_tokens is not supported with shards')
+        return Loader(dataset,
+                      batch_size=dataloader_setting['batch_size'],
+                      num_workers=dataloader_setting['num_workers'])
+    if dataloader_setting.get('max_tokens'):
+        # dynamic batching: variable-size chunks packed up to max_tokens samples
+        batch_sampler = TokenBudgetBatchSampler(
+            dataset.lengths(), dataloader_setting['max_tokens'], shuffle=shuffle)
+        return Loader(dataset,
+                      batch_sampler=batch_sampler,
+                      num_workers=dataloader_setting['num_workers'],
+                      collate_fn=pad_collate)
+    return Loader(dataset,
+                  batch_size=dataloader_setting['batch_size'],
+                  num_workers=dataloader_setting['num_workers'],
+                  shuffle=shuffle)
+
+
+def make_dynamic_mix(opt):
+    # training mixtures drawn on the fly from a source store, only imported
+    # when dynamic mixing is on
+    from data_loader.DynamicMix import DynamicMix
+    audio_setting = opt['datasets']['audio_setting']
+    return DynamicMix(num_spks=opt['num_spks'],
+                      sample_rate=audio_setting['sample_rate'],
+                      chunk_size=audio_setting['chunk_size'],
+                      least_size=audio_setting['least_size'],
+                      **opt['datasets']['dynamic_mixing'])
+
+
+def make_shard_dataset(opt, split, shuffle):
+    # chunks streamed from the tar shards of create_librimix_from_metadata.py
+    audio_setting = opt['datasets']['audio_setting']
+    return ShardDataset(opt['datasets'][split]['shards'],
+                        num_spks=opt['num_spks'],
+                        sample_rate=audio_setting['sample_rate'],
+                        chunk_size=audio_setting['chunk_size'],
+                        least_size=audio_setting['least_size'],
+                        shuffle=shuffle)
+
+
 def make_dataloader(opt):
     # make train's dataloader
     
-    train_dataset = Datasets(
-        opt['datasets']['train']['dataroot_mix'],
-        [opt['datasets']['train']['dataroot_targets'][0],
-         opt['datasets']['train']['dataroot_targets'][1]],
-        **opt['datasets']['audio_setting'])
-    train_dataloader = Loader(train_dataset,
-                              batch_size=opt['datasets']['dataloader_setting']['batch_size'],
-                              num_workers=opt['datasets']['dataloader_setting']['num_workers'],
-                              shuffle=opt['datasets']['dataloader_setting']['shuffle'])
+    if opt['datasets'].get('dynamic_mixing'):
+        train_dataset = make_dynamic_mix(opt)
+    elif opt['datasets']['train'].get('shards'):
+        train_dataset = make_shard_dataset(
+            opt, 'train', shuffle=opt['datasets']['dataloader_setting']['shuffle'])
+    else:
+        train_dataset = Datasets(
+            opt['datasets']['train']['dataroot_mix'],
+            [opt['datasets']['train']['dataroot_targets'][0],
+             opt['datasets']['train']['dataroot_targets'][1]],
+            cache_dir=opt['datasets'].get('cache_dir'),
+            lazy=opt['datasets'].get('lazy', False),
+            manifest=opt['datasets']['train'].get('manifest'),
+            dynamic=bool(opt['datasets']['dataloader_setting'].get('max_tokens')),
+            **opt['datasets']['audio_setting'])
+    train_dataloader = make_loader(
+        train_dataset, opt, shuffle=opt['datasets']['dataloader_setting']['shuffle'])
     
     # make validation dataloader
     
-    val_dataset = Datasets(
-        opt['datasets']['val']['dataroot_mix'],
-        [opt['datasets']['val']['dataroot_targets'][0],
-         opt['datasets']['val']['dataroot_targets'][1]],
-        **opt['datasets']['audio_setting'])
-    val_dataloader = Loader(val_dataset,
-                            batch_size=opt['datasets']['dataloader_setting']['batch_size'],
-                            num_workers=opt['datasets']['dataloader_setting']['num_workers'],
-                            shuffle=False)
+    if opt['datasets']['val'].get('shards'):
+        val_dataset = make_shard_dataset(opt, 'val', shuffle=False)
+    else:
+        val_dataset = Datasets(
+            opt['datasets']['val']['dataroot_mix'],
+            [opt['datasets']['val']['dataroot_targets'][0],
+             opt['datasets']['val']['dataroot_targets'][1]],
+            cache_dir=opt['datasets'].get('cache_dir'),
+            lazy=opt['datasets'].get('lazy', False),
+            manifest=opt['datasets']['val'].get('manifest'),
+            dynamic=bool(opt['datasets']['dataloader_setting'].get('max_tokens')),
+            **opt['datasets']['audio_setting'])
+    val_dataloader = make_loader(
+        val_dataset, opt, shuffle=False)
     
     return train_dataloader, val_dataloader
 
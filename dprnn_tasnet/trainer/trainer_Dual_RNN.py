@@ -6,7 +6,7 @@ from model.loss import Loss
 from logger.set_logger import setup_logger
 import logging
 import time
-from utils.util import check_parameters
+from utils.util import check_parameters, autocast
 import sys
 sys.path.append('../')
 
@@ -28,6 +28,9 @@ class Trainer(object):
         self.logger = logging.getLogger(opt['logger']['name'])
         self.checkpoint = opt['train']['path']
         self.name = opt['name']
+        # fp32, or bf16 autocast of the forward pass (the loss stays in fp32)
+        self.precision = opt['train'].get('precision', 'fp32')
+        self.logger.info('Precision: {}'.format(self.precision))
 
         if opt['train']['gpuid']:
             self.logger.info('Load Nvida GPU .....')
@@ -69,28 +72,37 @@ class Trainer(object):
         else:
             self.clip_norm = 0
 
+    def _unpack(self, egs):
+        '''
+           (mix, ref) from the fixed-size loader or
+           (mix, ref, lengths) from pad_collate (dynamic batching)
+        '''
+        mix = egs[0].to(self.device)
+        ref = [egs[1][i].to(self.device) for i in range(self.num_spks)]
+        lengths = egs[2].to(self.device) if len(egs) > 2 else None
+        return mix, ref, lengths
+
     def train(self, epoch):
         self.logger.info("Inside train()")
         self.logger.info(
             'Start training from epoch: {:d}, iter: {:d}'.format(epoch, 0))
         self.dualrnn.train()
-        num_batchs = len(self.train_dataloader)
         total_loss = 0.0
         num_index = 1
         start_time = time.time()
-        for mix, ref in self.train_dataloader:
-            mix = mix.to(self.device)
-            ref = [ref[i].to(self.device) for i in range(self.num_spks)]
+        for egs in self.train_dataloader:
+            mix, ref, lengths = self._unpack(egs)
             self.optimizer.zero_grad()
 
-            if self.gpuid:
-                out = torch.nn.parallel.data_parallel(
-                    self.dualrnn, mix, device_ids=self.gpuid)
-                # out = self.dualrnn(mix)
-            else:
-                out = self.dualrnn(mix)
+            with autocast(self.device, self.precision):
+                if self.gpuid:
+                    out = torch.nn.parallel.data_parallel(
+                        self.dualrnn, mix, device_ids=self.gpuid)
+                    # out = self.dualrnn(mix)
+                else:
+                    out = self.dualrnn(mix)
 
-            l = Loss(out, ref)
+            l = Loss(out, ref, lengths)
             epoch_loss = l
             total_loss += epoch_loss.item()
             epoch_loss.backward()
@@ -106,9 +118,11 @@ class Trainer(object):
                 self.logger.info(message)
             num_index += 1
         end_time = time.time()
-        total_loss = total_loss/num_index
+        # batches actually seen, len() of a loader over tar shards is approximate
+        num_batchs = num_index - 1
+        total_loss = total_loss/max(num_batchs, 1)
         message = 'Finished *** <epoch:{:d}, iter:{:d}, lr:{:.3e}, loss:{:.3f}, Total time:{:.3f} min> '.format(
-            epoch, num_index, self.optimizer.param_groups[0]['lr'], total_loss, (end_time-start_time)/60)
+            epoch, num_batchs, self.optimizer.param_groups[0]['lr'], total_loss, (end_time-start_time)/60)
         self.logger.info(message)
         return total_loss
 
@@ -117,25 +131,24 @@ class Trainer(object):
         self.logger.info(
             'Start Validation from epoch: {:d}, iter: {:d}'.format(epoch, 0))
         self.dualrnn.eval()
-        num_batchs = len(self.val_dataloader)
         num_index = 1
         total_loss = 0.0
         start_time = time.time()
         with torch.no_grad():
-            for mix, ref in self.val_dataloader:
-                mix = mix.to(self.device)
-                ref = [ref[i].to(self.device) for i in range(self.num_spks)]
+            for egs in self.val_dataloader:
+                mix, ref, lengths = self._unpack(egs)
                 self.optimizer.zero_grad()
 
-                if self.gpuid:
-                    # model = torch.nn.DataParallel(self.dualrnn)
-                    # out = model(mix)
-                    out = torch.nn.parallel.data_parallel(
-                        self.dualrnn, mix, device_ids=self.gpuid)
-                else:
-                    out = self.dualrnn(mix)
+                with autocast(self.device, self.precision):
+                    if self.gpuid:
+                        # model = torch.nn.DataParallel(self.dualrnn)
+                        # out = model(mix)
+                        out = torch.nn.parallel.data_parallel(
+                            self.dualrnn, mix, device_ids=self.gpuid)
+                    else:
+                        out = self.dualrnn(mix)
 
-                l = Loss(out, ref)
+                l = Loss(out, ref, lengths)
                 epoch_loss = l
                 total_loss += epoch_loss.item()
                 if num_index % self.print_freq == 0:
@@ -144,9 +157,11 @@ class Trainer(object):
                     self.logger.info(message)
                 num_index += 1
         end_time = time.time()
-        total_loss = total_loss/num_index
+        # batches actually seen, len() of a loader over tar shards is approximate
+        num_batchs = num_index - 1
+        total_loss = total_loss/max(num_batchs, 1)
         message = 'Finished *** <epoch:{:d}, iter:{:d}, lr:{:.3e}, loss:{:.3f}, Total time:{:.3f} min> '.format(
-            epoch, num_index, self.optimizer.param_groups[0]['lr'], total_loss, (end_time-start_time)/60)
+            epoch, num_batchs, self.optimizer.param_groups[0]['lr'], total_loss, (end_time-start_time)/60)
         self.logger.info(message)
         return total_loss
 
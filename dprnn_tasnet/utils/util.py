@@ -1,3 +1,5 @@
+import itertools
+import contextlib
 import torch
 import torch.nn as nn
 
@@ -30,6 +32,113 @@ def handle_scp(scp_path):
     return scp_dict
 
 
+def handle_manifest(manifest_path):
+    '''
+    Read manifest file written by dataset/create_manifest.py
+    input:
+          manifest_path: .tsv file's file path
+    output:
+          manifest_dict: {'key': {'mix': 'wave file path', ...,
+                                  'sample_rate': int, 'channels': int, 'length': int}}
+    '''
+    manifest_dict = dict()
+    with open(manifest_path, 'r') as f:
+        columns = f.readline().strip().split('\t')
+        for l in f:
+            row = dict(zip(columns, l.strip().split('\t')))
+            for column in ('sample_rate', 'channels', 'length'):
+                row[column] = int(row[column])
+            manifest_dict[row.pop('key')] = row
+
+    return manifest_dict
+
+
+def align_speakers(prev, ests):
+    '''
+    Speaker order of a window that best continues the previous one
+    input:
+          prev: [spks, L] previous window's estimates on the overlap
+          ests: [spks, L] this window's estimates on the overlap
+    output:
+          perm: list, ests[perm] follows the speaker order of prev
+    '''
+    prev = prev - prev.mean(dim=-1, keepdim=True)
+    ests = ests - ests.mean(dim=-1, keepdim=True)
+    prev = prev / (prev.norm(dim=-1, keepdim=True) + 1e-8)
+    ests = ests / (ests.norm(dim=-1, keepdim=True) + 1e-8)
+    # [spks, spks] normalized correlation of every pair
+    corr = prev @ ests.t()
+    spks = range(corr.shape[0])
+    return list(max(itertools.permutations(spks),
+                    key=lambda perm: sum(corr[i, j] for i, j in zip(spks, perm))))
+
+
+def chunked_inference(net, egs, chunk_size, chunk_overlap):
+    '''
+    Separate a long mixture window by window, only one window is in the
+    model at a time so memory does not grow with the input length
+    input:
+          net: separation model, net([1, L]) -> spks x [1, L']
+          egs: mixture [1, T]
+          chunk_size: window size in samples
+          chunk_overlap: samples shared by two neighboring windows
+    output:
+          spks x [T] estimates on the cpu, the speakers of every window are
+          aligned to the previous one by correlating their overlap and the
+          windows are stitched with linear cross-fades (overlap-add)
+    '''
+    if not 0 < chunk_overlap < chunk_size:
+        raise ValueError('chunk_overlap must be in (0, chunk_size), got {:d}'.format(
+            chunk_overlap))
+    length = egs.shape[-1]
+    hop = chunk_size - chunk_overlap
+    starts = [0]
+    while starts[-1] + chunk_size < length:
+        starts.append(starts[-1] + hop)
+    # linear fades of the overlap, every sample keeps a non zero weight
+    ramp = torch.arange(1, chunk_overlap + 1, dtype=torch.float32) / (chunk_overlap + 1)
+    out, weight, prev = None, torch.zeros(length), None
+    for start in starts:
+        end = min(start + chunk_size, length)
+        ests = torch.stack([s[0, :end - start].detach().cpu().float()
+                            for s in net(egs[:, start:end])])
+        if out is None:
+            out = torch.zeros(ests.shape[0], length)
+        w = torch.ones(end - start)
+        if start > 0:
+            n = min(chunk_overlap, end - start)
+            ests = ests[align_speakers(prev[:, :n], ests[:, :n])]
+            w[:n] = ramp[:n]
+        if end < length:
+            w[-chunk_overlap:] = torch.min(w[-chunk_overlap:], ramp.flip(0))
+        out[:, start:end] += ests * w
+        weight[start:end] += w
+        # this window's estimates on the next overlap
+        prev = ests[:, hop:]
+    return list(out / weight)
+
+
+def autocast(device, precision='fp32'):
+    '''
+    Context of the forward pass for a precision
+    input:
+          device: torch.device (or str) of the model
+          precision: 'fp32', or 'bf16' for bfloat16 autocast: convolutions,
+                     matmuls and RNNs run in bf16 while the norms cast their
+                     input back to fp32; compute the loss after leaving the
+                     context, it casts the outputs to fp32
+    output:
+          context manager
+    '''
+    if precision == 'fp32':
+        return contextlib.nullcontext()
+    if precision != 'bf16':
+        raise ValueError('Unsupported precision {}, fp32 or bf16'.format(precision))
+    if not hasattr(torch, 'autocast'):
+        raise RuntimeError('bf16 autocast needs torch >= 1.10')
+    return torch.autocast(device_type=torch.device(device).type, dtype=torch.bfloat16)
+
+
 def check_parameters(net):
     '''
         Returns module parameters. Mb